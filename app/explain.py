@@ -0,0 +1,94 @@
+# app/explain.py
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+from PIL import Image
+
+OVERLAY_ALPHA = 0.45
+OVERLAY_WORKERS = int(os.environ.get("OVERLAY_WORKERS", "2"))
+# Max overlays kept un-rendered (batch mode) before the oldest are dropped
+MAX_DEFERRED = int(os.environ.get("MAX_DEFERRED_OVERLAYS", "1024"))
+
+
+def _jet_palette():
+    """256-entry blue -> cyan -> yellow -> red palette for PIL "P" images."""
+    palette = []
+    for i in range(256):
+        v = i / 255.0
+        r = min(max(1.5 - abs(4 * v - 3), 0.0), 1.0)
+        g = min(max(1.5 - abs(4 * v - 2), 0.0), 1.0)
+        b = min(max(1.5 - abs(4 * v - 1), 0.0), 1.0)
+        palette += [int(r * 255), int(g * 255), int(b * 255)]
+    return palette
+
+
+JET = _jet_palette()
+
+
+def render_overlay(img, cam, path):
+    """Upsamples a [0, 1] (h, w) CAM to the image size, colors it and blends it over img as a PNG."""
+    h, w = cam.shape
+    values = bytes(cam.mul(255).round().clamp(0, 255).to(torch.uint8).flatten().tolist())
+    heat = Image.frombytes("L", (w, h), values).resize(img.size, Image.BILINEAR)
+    heat.putpalette(JET)
+    overlay = Image.blend(img.convert("RGB"), heat.convert("RGB"), OVERLAY_ALPHA)
+    tmp_path = f"{path}.tmp.{threading.get_ident()}"
+    overlay.save(tmp_path, format="PNG")
+    os.replace(tmp_path, path)
+    return path
+
+
+class OverlayStore:
+    """Renders Grad-CAM overlays into results_dir off the request thread.
+
+    schedule() starts rendering right away on a small thread pool; defer() only keeps the
+    inputs (the CAM is a few hundred floats) and renders when the overlay is first fetched."""
+
+    def __init__(self, results_dir, workers=OVERLAY_WORKERS):
+        self.results_dir = results_dir
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="overlay")
+        self.pending = {}
+        self.deferred = OrderedDict()
+        self.lock = threading.Lock()
+
+    def path(self, name):
+        return os.path.join(self.results_dir, os.path.basename(name))
+
+    def schedule(self, name, img, cam):
+        path = self.path(name)
+        with self.lock:
+            if os.path.exists(path) or name in self.pending:
+                return
+            future = self.pool.submit(render_overlay, img, cam, path)
+            self.pending[name] = future
+        future.add_done_callback(lambda _: self._done(name))
+
+    def defer(self, name, img, cam):
+        with self.lock:
+            if os.path.exists(self.path(name)) or name in self.pending:
+                return
+            self.deferred[name] = (img, cam)
+            self.deferred.move_to_end(name)
+            while len(self.deferred) > MAX_DEFERRED:
+                self.deferred.popitem(last=False)
+
+    def _done(self, name):
+        with self.lock:
+            self.pending.pop(name, None)
+
+    def get(self, name):
+        """Returns the overlay's file path, rendering or waiting for it if needed; None if unknown."""
+        path = self.path(name)
+        with self.lock:
+            future = self.pending.get(name)
+            inputs = self.deferred.pop(name, None)
+            if future is None and inputs is not None:
+                future = self.pool.submit(render_overlay, inputs[0], inputs[1], path)
+                self.pending[name] = future
+                future.add_done_callback(lambda _: self._done(name))
+        if future is not None:
+            return future.result()
+        return path if os.path.exists(path) else None
@@ -0,0 +1,216 @@
+# app/inference.py
+import glob
+import hashlib
+import io
+import os
+import threading
+import time
+
+import torch
+import torch.nn.functional as F
+from PIL import Image
+
+from app.models import SmallCNN
+
+MODELS_DIR = os.environ.get("MODELS_DIR", "models")
+INPUT_SIZE = 224
+
+# Warm-up: number of forward passes per batch size, run once per registered model at startup.
+# This pays for allocator growth and oneDNN kernel JIT before the first real request does.
+WARMUP_ITERS = int(os.environ.get("WARMUP_ITERS", "3"))
+WARMUP_BATCH_SIZES = [int(b) for b in os.environ.get("WARMUP_BATCH_SIZES", "1,4,8").split(",") if b.strip()]
+
+# target -> (checkpoint file in MODELS_DIR, class labels in logit order)
+MODEL_SPECS = {
+    "brain": ("brain_model.pt", ["glioma", "meningioma", "no_tumor", "pituitary"]),
+    "eye": ("retina_model.pt", ["normal", "retinoblastoma", "uveal_melanoma"]),
+}
+
+# Extra checkpoints picked up for the "advanced" ensemble, e.g. models/brain_model.ens1.pt.
+# The primary checkpoint above is always the first member.
+ENSEMBLE_PATTERN = "{stem}.ens*.pt"
+
+# Test-time augmentation variants for the "advanced" analysis type; all are stacked into one batch
+TTA_VARIANTS = ["original", "hflip", "center_crop", "hflip_center_crop"]
+TTA_CROP_FRACTION = 0.875
+
+# ImageNet statistics, shape (3, 1, 1) so they broadcast over CHW tensors
+MEAN = torch.tensor([0.485, 0.456, 0.406]).view(3, 1, 1)
+STD = torch.tensor([0.229, 0.224, 0.225]).view(3, 1, 1)
+
+device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+
+def load_image(image_bytes):
+    """Decodes uploaded bytes into an RGB PIL image resized to the model input resolution."""
+    img = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+    return img.resize((INPUT_SIZE, INPUT_SIZE), Image.BILINEAR)
+
+
+def to_tensor(img):
+    """Converts a PIL RGB image into a normalized 3xHxW float tensor."""
+    x = torch.frombuffer(bytearray(img.tobytes()), dtype=torch.uint8)
+    x = x.view(img.height, img.width, 3).permute(2, 0, 1).float().div_(255.0)
+    return (x - MEAN) / STD
+
+
+def center_crop(x, fraction=TTA_CROP_FRACTION):
+    """Crops the central fraction of a CxHxW tensor and resizes it back to the input resolution."""
+    h, w = x.shape[-2:]
+    ch, cw = int(h * fraction), int(w * fraction)
+    top, left = (h - ch) // 2, (w - cw) // 2
+    crop = x[..., top:top + ch, left:left + cw].unsqueeze(0)
+    return F.interpolate(crop, size=(h, w), mode="bilinear", align_corners=False)[0]
+
+
+def tta_batch(x):
+    """Stacks every TTA_VARIANTS view of one CxHxW image into a single (V, C, H, W) batch."""
+    cropped = center_crop(x)
+    views = {
+        "original": x,
+        "hflip": x.flip(-1),
+        "center_crop": cropped,
+        "hflip_center_crop": cropped.flip(-1),
+    }
+    return torch.stack([views[name] for name in TTA_VARIANTS])
+
+
+def model_version(path):
+    """Short content hash of a weights file, so records name the exact model that produced them."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()[:12]
+
+
+def grad_cam(model, feats, class_idx):
+    """Grad-CAM maps for a batch of conv activations, normalized to [0, 1], shape (B, h, w).
+
+    SmallCNN feeds globally average-pooled features into a linear head, so the gradient of
+    logit c w.r.t. activation A_k is W[c, k] / (h * w) at every position. The Grad-CAM channel
+    weights are therefore read from the classifier and reuse the prediction's forward pass;
+    no separate backward pass is needed."""
+    weights = model.classifier.weight[class_idx]
+    cam = torch.relu(torch.einsum("bk,bkhw->bhw", weights, feats))
+    peak = cam.flatten(1).amax(dim=1).clamp_min(1e-8)
+    return (cam / peak.view(-1, 1, 1)).cpu()
+
+
+class ModelRegistry:
+    """Holds one SmallCNN per target and tracks whether they are loaded and warmed."""
+
+    def __init__(self):
+        self.models = {}
+        self.ensembles = {}
+        self.labels = {}
+        self.versions = {}
+        self.loaded = False
+        self.warmed = False
+        self.error = None
+        self.warmup_ms = {}
+
+    @property
+    def ready(self):
+        return self.loaded and self.warmed
+
+    def load_all(self):
+        for target, (filename, labels) in MODEL_SPECS.items():
+            stem = os.path.splitext(filename)[0]
+            extra = sorted(glob.glob(os.path.join(MODELS_DIR, ENSEMBLE_PATTERN.format(stem=stem))))
+            members = [self._load(os.path.join(MODELS_DIR, filename), len(labels))]
+            members += [self._load(path, len(labels)) for path in extra]
+            self.models[target] = members[0]
+            self.ensembles[target] = members
+            self.labels[target] = labels
+            self.versions[target] = "+".join(model_version(path) for path in
+                                             [os.path.join(MODELS_DIR, filename)] + extra)
+        self.loaded = True
+
+    @staticmethod
+    def _load(path, num_classes):
+        model = SmallCNN(num_classes=num_classes)
+        model.load_state_dict(torch.load(path, map_location=device))
+        return model.to(device).eval()
+
+    def warmup(self, iters=WARMUP_ITERS, batch_sizes=WARMUP_BATCH_SIZES):
+        # always include the TTA batch size so the first "advanced" request hits warmed kernels
+        batch_sizes = sorted(set(batch_sizes) | {len(TTA_VARIANTS)})
+        for target, members in self.ensembles.items():
+            for bs in batch_sizes:
+                x = torch.randn(bs, 3, INPUT_SIZE, INPUT_SIZE, device=device)
+                start = time.perf_counter()
+                with torch.inference_mode():
+                    for _ in range(iters):
+                        for model in members:
+                            model(x)
+                self.warmup_ms[f"{target}/bs{bs}"] = round((time.perf_counter() - start) * 1000, 2)
+        self.warmed = True
+
+    def start(self):
+        """Loads and warms every registered model. Meant to run in a background thread."""
+        try:
+            self.load_all()
+            self.warmup()
+            print(f"Models ready (warm-up ms: {self.warmup_ms})")
+        except Exception as e:
+            self.error = str(e)
+            print(f"Model startup failed: {e}")
+
+    def start_in_background(self):
+        thread = threading.Thread(target=self.start, name="model-warmup", daemon=True)
+        thread.start()
+        return thread
+
+    def status(self):
+        return {
+            "ready": self.ready,
+            "loaded": self.loaded,
+            "warmed": self.warmed,
+            "models": {target: len(members) for target, members in sorted(self.ensembles.items())},
+            "versions": self.versions,
+            "warmup_ms": self.warmup_ms,
+            "error": self.error,
+        }
+
+    def predict(self, target, batch):
+        """Runs a batch of preprocessed images through the target's model.
+        Returns (softmax probabilities, Grad-CAM maps for each image's top class,
+        penultimate embeddings), all from the same forward pass."""
+        model = self.models[target]
+        with torch.inference_mode():
+            feats = model.forward_features(batch.to(device))
+            embeddings = model.embed(feats)
+            probs = torch.softmax(model.classifier(embeddings), dim=1)
+            cams = grad_cam(model, feats, probs.argmax(dim=1))
+            return probs.cpu(), cams, embeddings.float().cpu()
+
+    def predict_advanced(self, target, x):
+        """Test-time augmentation + checkpoint ensemble for one CxHxW image.
+
+        Every TTA view goes through each ensemble member as one batched forward pass.
+        Returns (mean probabilities, per-variant records with their top label and confidence,
+        Grad-CAM and penultimate embedding of the primary model on the original view)."""
+        batch = tta_batch(x).to(device)
+        labels = self.labels[target]
+        variants = []
+        all_probs = []
+        with torch.inference_mode():
+            for m, model in enumerate(self.ensembles[target]):
+                feats = model.forward_features(batch)
+                embeddings = model.embed(feats)
+                probs = torch.softmax(model.classifier(embeddings), dim=1).cpu()
+                if m == 0:
+                    primary_feats = feats[:1]  # TTA_VARIANTS[0] is the original view
+                    embedding = embeddings[0].float().cpu()
+                all_probs.append(probs)
+                for name, p in zip(TTA_VARIANTS, probs):
+                    idx = int(p.argmax())
+                    variants.append({"model": m, "variant": name, "prediction": labels[idx],
+                                     "confidence": float(p[idx])})
+            mean_probs = torch.cat(all_probs).mean(dim=0)
+            cam = grad_cam(self.models[target], primary_feats, mean_probs.argmax().view(1).to(device))
+        return mean_probs, variants, cam[0], embedding
+
+
+registry = ModelRegistry()
@@ -0,0 +1,156 @@
+# app/jobs.py
+import ipaddress
+import json
+import os
+import sqlite3
+import threading
+import time
+import urllib.request
+import uuid
+from urllib.parse import urlparse
+
+JOBS_DIR = os.environ.get("JOBS_DIR", "jobs")
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "1"))
+CALLBACK_TIMEOUT = float(os.environ.get("JOB_CALLBACK_TIMEOUT", "5"))
+# A job still "running" at startup was interrupted (crash/restart); after this many
+# attempts it is failed instead of re-queued, so one poison image cannot crash-loop the backend
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "3"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,            -- queued | running | done | failed
+    target TEXT NOT NULL,
+    type TEXT NOT NULL,
+    filename TEXT,
+    image_path TEXT NOT NULL,
+    callback_url TEXT,
+    result TEXT,                     -- JSON payload once done
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at);
+"""
+
+
+def is_local_url(url):
+    """Callbacks may only target this machine (loopback), never arbitrary hosts."""
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        return False
+    if parsed.hostname == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(parsed.hostname).is_loopback
+    except ValueError:
+        return False
+
+
+class JobQueue:
+    """Durable analysis queue in a local SQLite file; job images live in a ContentStore.
+
+    Jobs survive restarts: anything left "running" by a crash is re-queued on startup, unless it
+    has already been attempted max_attempts times."""
+
+    def __init__(self, store, jobs_dir=JOBS_DIR, max_attempts=JOB_MAX_ATTEMPTS):
+        self.store = store
+        os.makedirs(jobs_dir, exist_ok=True)
+        self.db_path = os.path.join(jobs_dir, "jobs.db")
+        self.local = threading.local()
+        self.wakeup = threading.Condition()
+        with self.conn() as conn:
+            conn.executescript(SCHEMA)
+            now = time.time()
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, updated_at = ? WHERE status = 'running' AND attempts >= ?",
+                (f"Backend stopped while running this job {max_attempts} times; giving up", now, max_attempts))
+            conn.execute("UPDATE jobs SET status = 'queued', updated_at = ? WHERE status = 'running'", (now,))
+
+    def conn(self):
+        # one connection per thread; WAL lets pollers read while a worker writes
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def enqueue(self, digest, filename, target, type, callback_url=None):
+        """Queues analysis of an image already held in the content store."""
+        image_path = self.store.path(digest)
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self.conn().execute(
+            "INSERT INTO jobs (id, status, target, type, filename, image_path, callback_url, created_at, updated_at)"
+            " VALUES (?, 'queued', ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, target, type, filename, image_path, callback_url, now, now),
+        )
+        with self.wakeup:
+            self.wakeup.notify()
+        return job_id
+
+    def get(self, job_id):
+        row = self.conn().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def claim(self):
+        """Atomically moves the oldest queued job to running and returns it, or None."""
+        conn = self.conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1").fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                    (time.time(), row["id"]))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return dict(row) if row is not None else None
+
+    def finish(self, job_id, result=None, error=None):
+        status = "failed" if error is not None else "done"
+        self.conn().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = ? WHERE id = ?",
+            (status, json.dumps(result) if result is not None else None, error, time.time(), job_id))
+
+    def notify_callback(self, job_id):
+        job = self.get(job_id)
+        if not job or not job["callback_url"]:
+            return
+        body = json.dumps({"id": job_id, "status": job["status"]}).encode()
+        req = urllib.request.Request(job["callback_url"], data=body, headers={"Content-Type": "application/json"})
+        try:
+            urllib.request.urlopen(req, timeout=CALLBACK_TIMEOUT).close()
+        except Exception as e:
+            print(f"Callback for job {job_id} failed: {e}")
+
+    def work(self, handler, is_ready):
+        """Worker loop: waits for models, then runs handler(job) for each claimed job."""
+        while True:
+            job = self.claim() if is_ready() else None
+            if job is None:
+                with self.wakeup:
+                    self.wakeup.wait(timeout=1.0)
+                continue
+            try:
+                result = handler(job)
+                self.finish(job["id"], result=result)
+            except Exception as e:
+                self.finish(job["id"], error=str(getattr(e, "detail", e)))
+            self.notify_callback(job["id"])
+
+    def start_workers(self, handler, is_ready, workers=JOB_WORKERS):
+        for i in range(workers):
+            thread = threading.Thread(target=self.work, args=(handler, is_ready), name=f"job-worker-{i}", daemon=True)
+            thread.start()
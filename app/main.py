@@ -0,0 +1,275 @@
+# app/main.py
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, File, Form, HTTPException, Request, Response, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, JSONResponse
+
+from app.explain import OverlayStore
+from app.inference import MODEL_SPECS, load_image, registry, to_tensor
+from app.jobs import JobQueue, is_local_url
+from app.records import RecordLog, prediction_record
+from app.similarity import SimilarityIndex
+from app.storage import SHA256_RE, ContentStore
+
+RESULTS_DIR = os.environ.get("RESULTS_DIR", "results")
+os.makedirs(RESULTS_DIR, exist_ok=True)
+
+# (image sha256, target, type) -> prediction payload, most recently used last
+PREDICTION_CACHE_SIZE = int(os.environ.get("PREDICTION_CACHE_SIZE", "512"))
+prediction_cache = OrderedDict()
+prediction_cache_lock = threading.Lock()
+
+overlays = OverlayStore(RESULTS_DIR)
+store = ContentStore()
+jobs = JobQueue(store)
+similarity = SimilarityIndex()
+records = RecordLog()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Load + warm models off the event loop so /healthz answers while /readyz still reports 503
+    registry.start_in_background()
+    # Queued jobs (including ones interrupted by a restart) resume once the models are ready
+    jobs.start_workers(run_job, lambda: registry.ready)
+    # Prediction records are rolled into Parquet periodically and once more on shutdown
+    records.start()
+    yield
+    records.close()
+
+
+app = FastAPI(title="Cancer Detector API", lifespan=lifespan)
+
+
+@app.get("/healthz")
+def healthz():
+    """Liveness: the process is up and serving requests."""
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+def readyz():
+    """Readiness: every registered model is loaded and warmed."""
+    status = registry.status()
+    if not registry.ready:
+        return JSONResponse(status_code=503, content=status)
+    return status
+
+
+@app.head("/images/{digest}")
+def has_image(digest: str):
+    """Hash-first upload, step 1: 200 if the backend already holds this content, else 404."""
+    return Response(status_code=200 if store.has(digest) else 404)
+
+
+@app.get("/images/{digest}", name="get_image")
+def get_image(digest: str):
+    if not store.has(digest):
+        raise HTTPException(status_code=404, detail="Image not found")
+    return FileResponse(store.path(digest))
+
+
+@app.put("/images/{digest}", status_code=201)
+async def put_image(request: Request, digest: str):
+    """Hash-first upload, step 2 (only on a miss): raw image bytes, verified against digest."""
+    body = await request.body()
+    try:
+        await run_in_threadpool(store.put, body, digest)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"sha256": digest}
+
+
+@app.post("/predict")
+def predict(request: Request, file: UploadFile = File(None), image_sha256: str = Form(None),
+            target: str = Form(...), type: str = Form("base"), batch: bool = Form(False)):
+    """Classifies one image, sent either as a file or as the sha256 of content already uploaded.
+    The response's image_url is a Grad-CAM overlay, rendered in the background; with
+    batch=true it is only rendered when the URL is first fetched."""
+    if not registry.ready:
+        raise HTTPException(status_code=503, detail="Models are still loading")
+    validate_request(target, type)
+
+    digest = resolve_image(file, image_sha256)
+    result = cached_prediction(digest, target, type, batch)
+    result["image_url"] = str(request.url_for("get_result_image", name=result.pop("overlay")))
+    return result
+
+
+@app.post("/jobs", status_code=202)
+def create_job(file: UploadFile = File(None), image_sha256: str = Form(None), filename: str = Form(None),
+               target: str = Form(...), type: str = Form("base"), callback_url: str = Form(None)):
+    """Queues an analysis and returns its id immediately; poll GET /jobs/{id} or pass a
+    local callback_url that receives {"id", "status"} when the job finishes.
+    The image is a file upload or the sha256 of content already held (404 if it is not)."""
+    validate_request(target, type)
+    if callback_url and not is_local_url(callback_url):
+        raise HTTPException(status_code=400, detail="callback_url must point to localhost")
+    digest = resolve_image(file, image_sha256)
+    job_id = jobs.enqueue(digest, filename or (file.filename if file else None), target, type, callback_url)
+    return {"id": job_id, "status": "queued"}
+
+
+@app.get("/jobs/{job_id}")
+def get_job(request: Request, job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    response = {key: job[key] for key in ("id", "status", "target", "type", "filename", "error",
+                                           "created_at", "updated_at")}
+    if job["result"] is not None:
+        result = dict(job["result"])
+        result["image_url"] = str(request.url_for("get_result_image", name=result.pop("overlay")))
+        response["result"] = result
+    return response
+
+
+@app.get("/similar")
+def similar(request: Request, image_sha256: str, target: str, k: int = 5):
+    """Past cases whose embeddings are nearest to an already-analyzed image (same target and
+    model version), each with the label it was predicted as and its cosine similarity."""
+    if target not in MODEL_SPECS:
+        raise HTTPException(status_code=400, detail=f"Unknown target: {target}")
+    if not SHA256_RE.match(image_sha256):
+        raise HTTPException(status_code=400, detail="image_sha256 must be a lowercase sha256 hex digest")
+    if not registry.ready:
+        raise HTTPException(status_code=503, detail="Models are still loading")
+    dim = registry.models[target].classifier.in_features
+    hits = similarity.similar(target, registry.versions[target], image_sha256, dim, k=max(1, min(k, 50)))
+    if hits is None:
+        raise HTTPException(status_code=404, detail="Image has not been analyzed for this target")
+    labels = registry.labels[target]
+    return {"image_sha256": image_sha256, "target": target, "similar": [
+        {"image_sha256": digest, "prediction": labels[label], "score": score,
+         "image_url": str(request.url_for("get_image", digest=digest))}
+        for digest, label, score in hits
+    ]}
+
+
+def validate_request(target, type):
+    # MODEL_SPECS keys are known before the models finish loading, so jobs can be queued early
+    if target not in MODEL_SPECS:
+        raise HTTPException(status_code=400, detail=f"Unknown target: {target}")
+    if type not in ("base", "advanced"):
+        raise HTTPException(status_code=400, detail=f"Unknown type: {type}")
+
+
+def resolve_image(file, image_sha256):
+    """Stores an uploaded file (or checks a referenced digest) and returns the content's sha256."""
+    if (file is None) == (image_sha256 is None):
+        raise HTTPException(status_code=400, detail="Send exactly one of file or image_sha256")
+    if file is not None:
+        return store.put(file.file.read())
+    if not store.has(image_sha256):
+        raise HTTPException(status_code=404, detail="Unknown image; upload it with PUT /images/{sha256}")
+    return image_sha256
+
+
+def run_job(job):
+    # queued jobs are bulk work: render overlays only when someone opens them
+    digest = os.path.basename(job["image_path"])
+    return cached_prediction(digest, job["target"], job["type"], batch=True, source="job")
+
+
+def cached_prediction(image_id, target, type, batch, source="predict"):
+    """Prediction payload for (stored image, target, type), served from the LRU cache when possible.
+    Every prediction actually computed is appended to the analytics record log."""
+    key = (image_id, target, type)
+    with prediction_cache_lock:
+        cached = prediction_cache.get(key)
+        if cached is not None:
+            prediction_cache.move_to_end(key)
+    if cached is None:
+        cached = run_prediction(store.get(image_id), image_id, target, type, batch)
+        timings = cached.pop("timings")
+        records.append(prediction_record(image_id, target, type, cached, registry.versions[target], source, timings))
+        with prediction_cache_lock:
+            prediction_cache[key] = cached
+            while len(prediction_cache) > PREDICTION_CACHE_SIZE:
+                prediction_cache.popitem(last=False)
+    return dict(cached)
+
+
+def run_prediction(image_bytes, image_id, target, type, batch):
+    """Runs the model on one image; the payload includes per-stage "timings" in milliseconds."""
+    start = time.perf_counter()
+    try:
+        img = load_image(image_bytes)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Could not decode image")
+    decoded = time.perf_counter()
+
+    x = to_tensor(img)
+    preprocessed = time.perf_counter()
+    labels = registry.labels[target]
+    variants, agreement = None, None
+    if type == "advanced":
+        probs, variants, cam, embedding = registry.predict_advanced(target, x)
+    else:
+        probs, cams, embeddings = registry.predict(target, x.unsqueeze(0))
+        probs, cam, embedding = probs[0], cams[0], embeddings[0]
+    inferred = time.perf_counter()
+    idx = int(probs.argmax())
+    # the embedding came out of the same forward pass; the first analysis of an image with
+    # the current weights indexes it
+    similarity.add(target, registry.versions[target], image_id, embedding.numpy(), idx)
+    details = f"{target} / {type}: {labels[idx]} ({float(probs[idx]):.1%} confidence)"
+    if variants:
+        agree = sum(v["prediction"] == labels[idx] for v in variants)
+        agreement = agree / len(variants)
+        per_variant = ", ".join(f"{v['variant']}#{v['model']}: {v['prediction']}" for v in variants)
+        details += f" — {agree}/{len(variants)} TTA/ensemble variants agree ({per_variant})"
+
+    # the version keeps overlays from earlier weights (results/ survives restarts) from being served
+    overlay = f"{image_id}_{target}_{type}_{registry.versions[target]}_cam.png"
+    if batch:
+        overlays.defer(overlay, img, cam)
+    else:
+        overlays.schedule(overlay, img, cam)
+
+    return {
+        "image_sha256": image_id,
+        "target": target,
+        "prediction": labels[idx],
+        "confidence": float(probs[idx]),
+        "probabilities": {label: float(p) for label, p in zip(labels, probs)},
+        "details": details,
+        "agreement": agreement,
+        "variants": variants,
+        "overlay": overlay,
+        "timings": {
+            "decode_ms": (decoded - start) * 1000,
+            "preprocess_ms": (preprocessed - decoded) * 1000,
+            "inference_ms": (inferred - preprocessed) * 1000,
+            "total_ms": (time.perf_counter() - start) * 1000,
+        },
+    }
+
+
+@app.get("/results/{name}", name="get_result_image")
+def get_result_image(name: str):
+    path = overlays.get(name) or rebuild_overlay(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Result not found")
+    return FileResponse(path)
+
+
+def rebuild_overlay(name):
+    """Re-renders a deferred overlay that was lost (restart or eviction) from the stored upload."""
+    if not name.endswith("_cam.png") or not registry.ready:
+        return None
+    parts = name[:-len("_cam.png")].split("_")
+    if len(parts) != 4:
+        return None
+    image_id, target, type, version = parts
+    if target not in registry.models or type not in ("base", "advanced") or not store.has(image_id):
+        return None
+    if version != registry.versions[target]:
+        return None  # made by other weights; the current model cannot reproduce it
+    run_prediction(store.get(image_id), image_id, target, type, batch=True)
+    return overlays.get(name)
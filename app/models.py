@@ -0,0 +1,41 @@
+# app/models.py
+import torch
+import torch.nn as nn
+
+
+def conv_block(in_ch, out_ch):
+    return nn.Sequential(
+        nn.Conv2d(in_ch, out_ch, kernel_size=3, padding=1),
+        nn.BatchNorm2d(out_ch),
+        nn.ReLU(inplace=True),
+        nn.MaxPool2d(2),
+    )
+
+
+class SmallCNN(nn.Module):
+    """Lightweight classifier for 3x224x224 scans (brain MRI / retina fundus)."""
+
+    def __init__(self, num_classes=2):
+        super().__init__()
+        self.features = nn.Sequential(
+            conv_block(3, 16),
+            conv_block(16, 32),
+            conv_block(32, 64),
+            conv_block(64, 64),
+        )
+        self.pool = nn.AdaptiveAvgPool2d(1)
+        self.classifier = nn.Linear(64, num_classes)
+
+    def forward_features(self, x):
+        """Last conv activations, (B, 64, H/16, W/16); used for Grad-CAM."""
+        return self.features(x)
+
+    def embed(self, feats):
+        """Penultimate (pooled) features, (B, 64); used for similar-case retrieval."""
+        return torch.flatten(self.pool(feats), 1)
+
+    def head(self, feats):
+        return self.classifier(self.embed(feats))
+
+    def forward(self, x):
+        return self.head(self.forward_features(x))
@@ -0,0 +1,155 @@
+# app/records.py
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+RECORDS_DIR = os.environ.get("RECORDS_DIR", "records")
+# Roll the append log into Parquet this often, or sooner once it reaches ROLL_BYTES
+ROLL_SECONDS = float(os.environ.get("RECORDS_ROLL_SECONDS", "300"))
+ROLL_BYTES = int(os.environ.get("RECORDS_ROLL_BYTES", str(64 * 1024 * 1024)))
+WRITE_BUFFER_BYTES = 1024 * 1024
+PARQUET_COMPRESSION = "zstd"
+
+TIMING_FIELDS = ("decode_ms", "preprocess_ms", "inference_ms", "total_ms")
+
+SCHEMA = pa.schema([
+    ("ts", pa.timestamp("ms", tz="UTC")),
+    ("image_sha256", pa.string()),
+    ("target", pa.string()),
+    ("type", pa.string()),
+    ("prediction", pa.string()),
+    ("confidence", pa.float32()),
+    ("probabilities", pa.map_(pa.string(), pa.float32())),
+    ("model_version", pa.string()),
+    ("source", pa.string()),
+] + [(name, pa.float32()) for name in TIMING_FIELDS])
+
+
+class RecordLog:
+    """Structured prediction records for offline analytics (drift / accuracy audits).
+
+    append() only writes one JSON line into a buffered file, so it is cheap on the request
+    path. A background thread periodically rotates that log and rolls it into zstd Parquet
+    files under root/parquet/date=YYYY-MM-DD/target=<target>/ (hive partitioning, so
+    pyarrow.dataset / DuckDB / Spark can prune by date and target). One process per root."""
+
+    def __init__(self, root=RECORDS_DIR, roll_seconds=ROLL_SECONDS):
+        self.root = root
+        self.log_dir = os.path.join(root, "log")
+        self.parquet_dir = os.path.join(root, "parquet")
+        os.makedirs(self.log_dir, exist_ok=True)
+        self.roll_seconds = roll_seconds
+        self.lock = threading.Lock()
+        self.roll_lock = threading.Lock()
+        self.stop = threading.Event()
+        self.wake = threading.Event()  # set on a timer-less roll request (log full, or close)
+        self.thread = None
+        self._open()
+
+    def _open(self):
+        self.path = os.path.join(self.log_dir, f"current-{uuid.uuid4().hex}.jsonl")
+        self.file = open(self.path, "a", buffering=WRITE_BUFFER_BYTES, encoding="utf-8")
+        self.size = 0  # counted here: file.tell() would flush the write buffer on every append
+        self.roll_requested = False
+
+    def append(self, record):
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self.lock:
+            self.file.write(line)
+            self.size += len(line)
+            # ask the roller thread once per log, not once per append
+            request = self.size >= ROLL_BYTES and not self.roll_requested
+            if request:
+                self.roll_requested = True
+        if request:
+            self.wake.set()
+
+    def _rotate(self):
+        """Closes the current log (flushing its buffer) and starts a new one; returns the closed path."""
+        with self.lock:
+            self.file.close()
+            closed = self.path
+            self._open()
+        sealed = closed.replace("current-", "sealed-")
+        os.replace(closed, sealed)
+        return sealed
+
+    def roll(self):
+        """Rotates the log and converts every sealed log (including ones left by a crash) to Parquet."""
+        with self.roll_lock:
+            self._rotate()
+            # current-* files not ours were left by an earlier process; seal them too
+            for path in glob.glob(os.path.join(self.log_dir, "current-*.jsonl")):
+                if path != self.path:
+                    os.replace(path, path.replace("current-", "sealed-"))
+            for path in sorted(glob.glob(os.path.join(self.log_dir, "sealed-*.jsonl"))):
+                self._to_parquet(path)
+                os.remove(path)
+
+    def _to_parquet(self, path):
+        groups = {}
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # torn last line from a crash
+                date = datetime.fromtimestamp(record["ts"] / 1000, tz=timezone.utc).strftime("%Y-%m-%d")
+                groups.setdefault((date, record["target"]), []).append(record)
+
+        for (date, target), rows in groups.items():
+            columns = {name: [row.get(name) for row in rows] for name in SCHEMA.names}
+            columns["probabilities"] = [list(row["probabilities"].items()) for row in rows]
+            # target lives in the partition path, like pyarrow's own write_to_dataset
+            table = pa.Table.from_pydict(columns, schema=SCHEMA).drop_columns(["target"])
+            out_dir = os.path.join(self.parquet_dir, f"date={date}", f"target={target}")
+            os.makedirs(out_dir, exist_ok=True)
+            out_path = os.path.join(out_dir, f"part-{os.path.basename(path)[len('sealed-'):-len('.jsonl')]}.parquet")
+            # write-then-rename: a crash never leaves a half-written file for readers to trip on
+            pq.write_table(table, out_path + ".tmp", compression=PARQUET_COMPRESSION)
+            os.replace(out_path + ".tmp", out_path)
+
+    def _run(self):
+        while True:
+            self.wake.wait(self.roll_seconds)
+            self.wake.clear()
+            if self.stop.is_set():
+                return
+            try:
+                self.roll()
+            except Exception as e:
+                print(f"Rolling prediction records failed: {e}")
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="records-roller", daemon=True)
+        self.thread.start()
+
+    def close(self):
+        """Stops the roller and rolls whatever is still buffered."""
+        self.stop.set()
+        self.wake.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.roll()
+
+
+def prediction_record(image_id, target, type, payload, model_version, source, timings):
+    return {
+        "ts": int(time.time() * 1000),
+        "image_sha256": image_id,
+        "target": target,
+        "type": type,
+        "prediction": payload["prediction"],
+        "confidence": payload["confidence"],
+        "probabilities": payload["probabilities"],
+        "model_version": model_version,
+        "source": source,
+        **{name: timings.get(name) for name in TIMING_FIELDS},
+    }
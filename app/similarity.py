@@ -0,0 +1,312 @@
+# app/similarity.py
+import glob
+import json
+import os
+import threading
+
+import numpy as np
+
+INDEX_DIR = os.environ.get("INDEX_DIR", "index")
+# Queries scan this many IVF lists (more = better recall, slower)
+NPROBE = int(os.environ.get("SIMILAR_NPROBE", "16"))
+# Rebuild the IVF layout once the unindexed tail grows past max(MIN_TAIL, TAIL_FRACTION * indexed)
+MIN_TAIL = int(os.environ.get("SIMILAR_MIN_TAIL", "2048"))
+TAIL_FRACTION = 0.1
+KMEANS_ITERS = 10
+# Rebuild memory stays bounded: k-means trains on at most this many rows, and row-to-list
+# assignment scores ASSIGN_CHUNK rows at a time (ASSIGN_CHUNK x nlist float32 scratch)
+KMEANS_SAMPLE = int(os.environ.get("SIMILAR_KMEANS_SAMPLE", "131072"))
+ASSIGN_CHUNK = 4096
+
+
+def normalize(x):
+    x = np.asarray(x, dtype=np.float32)
+    return x / np.maximum(np.linalg.norm(x, axis=-1, keepdims=True), 1e-8)
+
+
+def prefix_of(digest):
+    """First 8 bytes of a sha256 hex digest as a uint64, used for compact membership lookups."""
+    return np.uint64(int(digest[:16], 16))
+
+
+def assign_lists(vectors, centroids, chunk=ASSIGN_CHUNK):
+    """Nearest centroid per row, scoring chunk rows at a time so the score matrix stays small."""
+    out = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), chunk):
+        block = np.asarray(vectors[start:start + chunk], dtype=np.float32)
+        out[start:start + chunk] = np.argmax(block @ centroids.T, axis=1)
+    return out
+
+
+def spherical_kmeans(x, nlist, iters=KMEANS_ITERS, seed=0):
+    """k-means on unit vectors with cosine similarity; returns (nlist, dim) unit centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(len(x), size=nlist, replace=False)].copy()
+    for _ in range(iters):
+        assign = assign_lists(x, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, x)
+        empty = np.bincount(assign, minlength=nlist) == 0
+        # re-seed empty lists from random points so every list stays in use
+        sums[empty] = x[rng.choice(len(x), size=int(empty.sum()))]
+        centroids = normalize(sums)
+    return centroids
+
+
+class EmbeddingIndex:
+    """Append-only float16 embedding store for one target with an IVF (inverted file) search layout.
+
+    Files in root/ (all memory-mapped or tiny, so opening the index is O(1) in its size):
+      vectors.f16 / ids.bin / labels.u8  rows in insertion order (embedding, sha256, predicted label)
+      gen<N>.ivf.f16 / .ivf_rows.i64 / .offsets.npy / .centroids.npy  indexed rows grouped by IVF list
+      meta.json  dim, how many leading rows the IVF layout covers and which generation N it is
+
+    A rebuild writes a new generation next to the live one; replacing meta.json is the single
+    commit point, so a crash mid-rebuild leaves the previous layout and row count intact.
+
+    Rows added since the last rebuild (the "tail") are kept in RAM and scanned exactly;
+    a background rebuild re-clusters everything once the tail gets large."""
+
+    def __init__(self, root, dim):
+        self.root = root
+        self.dim = dim
+        os.makedirs(root, exist_ok=True)
+        self.lock = threading.Lock()
+        self.rebuilding = False
+        self._load()
+
+    def _path(self, name):
+        return os.path.join(self.root, name)
+
+    def _gen_path(self, generation, name):
+        return self._path(f"gen{generation}.{name}")
+
+    def _remove_stale_generations(self):
+        """Deletes layout files of any generation but the committed one (old or half-built)."""
+        for path in glob.glob(self._path("gen*.*")):
+            if not os.path.basename(path).startswith(f"gen{self.generation}."):
+                os.remove(path)
+
+    def _rows_on_disk(self):
+        files = (("vectors.f16", self.dim * 2), ("ids.bin", 32), ("labels.u8", 1))
+        for name, _ in files:
+            open(self._path(name), "ab").close()
+        # a torn append (crash mid-add) leaves the shortest file authoritative; cut the others back
+        count = min(os.path.getsize(self._path(name)) // width for name, width in files)
+        for name, width in files:
+            if os.path.getsize(self._path(name)) != count * width:
+                os.truncate(self._path(name), count * width)
+        return count
+
+    def _load(self):
+        meta_path = self._path("meta.json")
+        meta = json.load(open(meta_path)) if os.path.exists(meta_path) else {}
+        if "generation" not in meta:
+            meta = {"indexed": 0, "generation": 0}  # empty, or a pre-generation layout: re-cluster it
+        self.indexed = meta["indexed"]
+        self.generation = meta["generation"]
+        self._remove_stale_generations()
+        self.count = self._rows_on_disk()
+        if self.indexed:
+            self.centroids = np.load(self._gen_path(self.generation, "centroids.npy"))
+            self.offsets = np.load(self._gen_path(self.generation, "offsets.npy"))
+            self.ivf = np.memmap(self._gen_path(self.generation, "ivf.f16"), dtype=np.float16, mode="r",
+                                 shape=(self.indexed, self.dim))
+            self.ivf_rows = np.memmap(self._gen_path(self.generation, "ivf_rows.i64"), dtype=np.int64, mode="r",
+                                      shape=(self.indexed,))
+            ids = np.memmap(self._path("ids.bin"), dtype=np.uint8, mode="r", shape=(self.count, 32))
+            self._build_prefix_lookup(ids[:self.indexed])
+        else:
+            self.centroids = self.offsets = self.ivf = self.ivf_rows = None
+            self.prefix_lookup = (np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int64))
+        # tail: rows [indexed, count) held in memory, row indexed + i at tail[i]
+        self.tail = np.empty((max(MIN_TAIL, self.count - self.indexed), self.dim), dtype=np.float32)
+        self.tail_prefixes = {}
+        if self.count > self.indexed:
+            vectors = np.memmap(self._path("vectors.f16"), dtype=np.float16, mode="r", shape=(self.count, self.dim))
+            ids = np.memmap(self._path("ids.bin"), dtype=np.uint8, mode="r", shape=(self.count, 32))
+            self.tail[:self.count - self.indexed] = vectors[self.indexed:]
+            for row in range(self.indexed, self.count):
+                self.tail_prefixes[int.from_bytes(ids[row, :8].tobytes(), "big")] = row
+
+    def _build_prefix_lookup(self, ids):
+        prefixes = ids[:, :8].copy().view(">u8").ravel().astype(np.uint64)
+        order = np.argsort(prefixes, kind="stable")
+        # (sorted prefixes, row of each) swapped as one attribute so readers never mix generations
+        self.prefix_lookup = (prefixes[order], order.astype(np.int64))
+
+    def find(self, digest):
+        """Row of a stored sha256 digest, or None."""
+        with self.lock:
+            return self._find(digest)
+
+    def _find(self, digest):
+        # caller holds self.lock: rebuild() swaps the lookup and the tail together under it
+        prefix = prefix_of(digest)
+        row = self.tail_prefixes.get(int(prefix))
+        if row is not None:
+            return row
+        prefixes, rows = self.prefix_lookup
+        i = np.searchsorted(prefixes, prefix)
+        if i < len(prefixes) and prefixes[i] == prefix:
+            return int(rows[i])
+        return None
+
+    def vector(self, row):
+        vectors = np.memmap(self._path("vectors.f16"), dtype=np.float16, mode="r", shape=(self.count, self.dim))
+        return np.asarray(vectors[row], dtype=np.float32)
+
+    def digest(self, row):
+        with open(self._path("ids.bin"), "rb") as f:
+            f.seek(row * 32)
+            return f.read(32).hex()
+
+    def label(self, row):
+        with open(self._path("labels.u8"), "rb") as f:
+            f.seek(row)
+            return f.read(1)[0]
+
+    def add(self, digest, embedding, label):
+        """Appends one embedding; no-op if this image is already stored."""
+        vec = normalize(embedding).astype(np.float16)
+        with self.lock:
+            if self._find(digest) is not None:
+                return False
+            with open(self._path("vectors.f16"), "ab") as f:
+                f.write(vec.tobytes())
+            with open(self._path("ids.bin"), "ab") as f:
+                f.write(bytes.fromhex(digest))
+            with open(self._path("labels.u8"), "ab") as f:
+                f.write(bytes([label]))
+            row = self.count
+            n = row - self.indexed
+            if n == len(self.tail):
+                # grow into a new array so searches holding the old one stay valid
+                grown = np.empty((2 * len(self.tail), self.dim), dtype=np.float32)
+                grown[:n] = self.tail
+                self.tail = grown
+            self.tail[n] = vec
+            self.tail_prefixes[int(prefix_of(digest))] = row
+            self.count += 1
+            needs_rebuild = n + 1 > max(MIN_TAIL, TAIL_FRACTION * self.indexed) and not self.rebuilding
+            if needs_rebuild:
+                self.rebuilding = True
+        if needs_rebuild:
+            threading.Thread(target=self.rebuild, name="ivf-rebuild", daemon=True).start()
+        return True
+
+    def rebuild(self):
+        """Re-clusters all stored rows into a fresh IVF layout and swaps it in atomically."""
+        try:
+            with self.lock:
+                count = self.count
+            vectors = np.memmap(self._path("vectors.f16"), dtype=np.float16, mode="r", shape=(count, self.dim))
+            ids = np.memmap(self._path("ids.bin"), dtype=np.uint8, mode="r", shape=(count, 32))
+            nlist = int(min(65536, count, KMEANS_SAMPLE, max(1, 4 * np.sqrt(count))))
+            rng = np.random.default_rng(0)
+            size = min(count, nlist * 64, KMEANS_SAMPLE)
+            sample = normalize(vectors[np.sort(rng.choice(count, size=size, replace=False))])
+            centroids = spherical_kmeans(sample, nlist)
+            lists = assign_lists(vectors, centroids)
+            order = np.argsort(lists, kind="stable")
+            offsets = np.concatenate([[0], np.cumsum(np.bincount(lists, minlength=nlist))]).astype(np.int64)
+
+            generation = self.generation + 1
+            ivf = np.memmap(self._gen_path(generation, "ivf.f16"), dtype=np.float16, mode="w+", shape=(count, self.dim))
+            for start in range(0, count, 65536):
+                ivf[start:start + 65536] = vectors[order[start:start + 65536]]
+            ivf.flush()
+            del ivf
+            order.astype(np.int64).tofile(self._gen_path(generation, "ivf_rows.i64"))
+            np.save(self._gen_path(generation, "offsets.npy"), offsets)
+            np.save(self._gen_path(generation, "centroids.npy"), centroids)
+            # the new layout must be durable before meta.json points at it
+            for name in ("ivf.f16", "ivf_rows.i64", "offsets.npy", "centroids.npy"):
+                with open(self._gen_path(generation, name), "rb") as f:
+                    os.fsync(f.fileno())
+
+            with self.lock:
+                with open(self._path("meta.json.tmp"), "w") as f:
+                    json.dump({"dim": self.dim, "indexed": count, "nlist": nlist, "generation": generation}, f)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(self._path("meta.json.tmp"), self._path("meta.json"))  # commit point
+
+                self.generation = generation
+                self.centroids, self.offsets = centroids, offsets
+                self.ivf = np.memmap(self._gen_path(generation, "ivf.f16"), dtype=np.float16, mode="r",
+                                     shape=(count, self.dim))
+                self.ivf_rows = np.memmap(self._gen_path(generation, "ivf_rows.i64"), dtype=np.int64, mode="r",
+                                          shape=(count,))
+                self._build_prefix_lookup(ids)
+                # rows added while rebuilding stay in the tail
+                dropped = count - self.indexed
+                tail = np.empty_like(self.tail)
+                tail[:self.count - count] = self.tail[dropped:self.count - self.indexed]
+                self.tail = tail
+                self.indexed = count
+                self.tail_prefixes = {p: r for p, r in self.tail_prefixes.items() if r >= count}
+                # searches still holding the old memmaps keep reading them after the unlink
+                self._remove_stale_generations()
+            print(f"Rebuilt similarity index {self.root}: {count} rows, {nlist} lists")
+        finally:
+            self.rebuilding = False
+
+    def search(self, query, k=5, nprobe=NPROBE, exclude_row=None):
+        """Top-k (row, cosine score) for a query embedding, best first."""
+        q = normalize(query)
+        with self.lock:
+            centroids, offsets, ivf, ivf_rows = self.centroids, self.offsets, self.ivf, self.ivf_rows
+            indexed, tail = self.indexed, self.tail[:self.count - self.indexed]
+
+        rows, scores = [], []
+        if centroids is not None:
+            probe = np.argsort(-(centroids @ q))[:nprobe]
+            for lst in probe:
+                lo, hi = offsets[lst], offsets[lst + 1]
+                if hi > lo:
+                    scores.append(np.asarray(ivf[lo:hi], dtype=np.float32) @ q)
+                    rows.append(np.asarray(ivf_rows[lo:hi]))
+        if len(tail):
+            scores.append(tail @ q)
+            rows.append(np.arange(indexed, indexed + len(tail)))
+        if not rows:
+            return []
+
+        rows, scores = np.concatenate(rows), np.concatenate(scores)
+        if exclude_row is not None:
+            keep = rows != exclude_row
+            rows, scores = rows[keep], scores[keep]
+        top = np.argpartition(-scores, min(k, len(scores)) - 1)[:k] if len(scores) > k else np.arange(len(scores))
+        top = top[np.argsort(-scores[top])]
+        return [(int(rows[i]), float(scores[i])) for i in top]
+
+
+class SimilarityIndex:
+    """One EmbeddingIndex per (target, model version), created on first use under
+    INDEX_DIR/<target>/<version>/. Embeddings from different weights live in different
+    feature spaces, so a retrained model starts a fresh index instead of mixing with the old one."""
+
+    def __init__(self, root=INDEX_DIR):
+        self.root = root
+        self.indexes = {}
+        self.lock = threading.Lock()
+
+    def get(self, target, version, dim):
+        key = (target, version)
+        with self.lock:
+            if key not in self.indexes:
+                self.indexes[key] = EmbeddingIndex(os.path.join(self.root, target, version), dim)
+            return self.indexes[key]
+
+    def add(self, target, version, digest, embedding, label):
+        return self.get(target, version, len(embedding)).add(digest, embedding, label)
+
+    def similar(self, target, version, digest, dim, k=5):
+        """Nearest stored cases to an already-indexed image; list of (digest, label index, score)."""
+        index = self.get(target, version, dim)
+        row = index.find(digest)
+        if row is None:
+            return None
+        hits = index.search(index.vector(row), k=k, exclude_row=row)
+        return [(index.digest(r), index.label(r), score) for r, score in hits]
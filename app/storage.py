@@ -0,0 +1,48 @@
+# app/storage.py
+import hashlib
+import os
+import re
+import uuid
+
+UPLOADS_DIR = os.environ.get("UPLOADS_DIR", "uploads")
+
+SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+class ContentStore:
+    """Uploaded images on disk, addressed by the sha256 of their bytes.
+
+    Clients can ask whether an image is already held (by hash) before uploading it, and
+    identical uploads are stored once."""
+
+    def __init__(self, root=UPLOADS_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, digest):
+        if not SHA256_RE.match(digest):
+            raise ValueError(f"Not a sha256 hex digest: {digest!r}")
+        return os.path.join(self.root, digest)
+
+    def has(self, digest):
+        return SHA256_RE.match(digest) is not None and os.path.exists(self.path(digest))
+
+    def put(self, data, expected_digest=None):
+        """Stores data (durably, via temp file + rename) and returns its digest.
+        Raises ValueError if expected_digest is given and does not match."""
+        digest = hashlib.sha256(data).hexdigest()
+        if expected_digest is not None and digest != expected_digest:
+            raise ValueError("Content does not match the given sha256")
+        path = self.path(digest)
+        if not os.path.exists(path):
+            tmp_path = f"{path}.tmp.{uuid.uuid4().hex}"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        return digest
+
+    def get(self, digest):
+        with open(self.path(digest), "rb") as f:
+            return f.read()
@@ -0,0 +1,70 @@
+# training/checkpoint.py
+import argparse
+import glob
+import os
+import random
+import torch
+
+def atomic_save(obj, path):
+    """torch.save to a temp file in the same directory, then rename over path.
+    A crash mid-write leaves the previous file intact instead of a truncated one."""
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    torch.save(obj, tmp_path)
+    os.replace(tmp_path, path)
+
+def checkpoint_pattern(save_path):
+    # models/brain_model.pt -> models/brain_model.ep*.ckpt
+    return f"{os.path.splitext(save_path)[0]}.ep*.ckpt"
+
+def checkpoint_path(save_path, epoch):
+    return f"{os.path.splitext(save_path)[0]}.ep{epoch:04d}.ckpt"
+
+def positive_int(value):
+    """argparse type for --keep-last: 0 would prune the checkpoint that was just written."""
+    n = int(value)
+    if n < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {n}")
+    return n
+
+def rng_state():
+    state = {"torch": torch.get_rng_state(), "python": random.getstate()}
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+def set_rng_state(state):
+    torch.set_rng_state(state["torch"])
+    random.setstate(state["python"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+def save_checkpoint(save_path, epoch, model, opt, keep_last=3, **extra):
+    """Writes model/optimizer/epoch/RNG state next to save_path and prunes all but the newest keep_last."""
+    if keep_last < 1:
+        raise ValueError(f"keep_last must be at least 1, got {keep_last}")
+    state = {
+        "epoch": epoch,
+        "model": model.state_dict(),
+        "optimizer": opt.state_dict(),
+        "rng": rng_state(),
+        **extra,
+    }
+    path = checkpoint_path(save_path, epoch)
+    atomic_save(state, path)
+    paths = sorted(glob.glob(checkpoint_pattern(save_path)))
+    for old in paths[:max(0, len(paths) - keep_last)]:
+        os.remove(old)
+    return path
+
+def latest_checkpoint(save_path):
+    paths = sorted(glob.glob(checkpoint_pattern(save_path)))
+    return paths[-1] if paths else None
+
+def load_checkpoint(path, model, opt):
+    """Restores model, optimizer and RNG state in place; returns the full checkpoint dict."""
+    # weights_only=False: the checkpoint holds Python RNG state, not just tensors
+    state = torch.load(path, map_location="cpu", weights_only=False)
+    model.load_state_dict(state["model"])
+    opt.load_state_dict(state["optimizer"])
+    set_rng_state(state["rng"])
+    return state
@@ -0,0 +1,243 @@
+# training/dataset_index.py
+"""
+Perceptual-hash index of an image dataset: near-duplicate removal and leakage-free splits.
+
+The dataset is a folder per class (root/<label>/**/*.png|jpg|...). Every image gets a 64-bit
+DCT perceptual hash, computed in a process pool. Images within --max-distance bits of each
+other are joined into one group through a multi-index hash lookup, so there is no all-pairs
+comparison. Each group keeps one representative and its split is chosen from a hash of the
+group. Near-duplicates can therefore never end up on both sides of train/val/test. The
+result is a CSV manifest that train_dummy_models.py --manifest consumes.
+
+    python -m app.training.dataset_index data/brain --target brain --out models/brain_manifest.csv
+    python -m app.training.dataset_index --check models/brain_manifest.csv
+"""
+import argparse
+import csv
+import hashlib
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+from PIL import Image
+from torch.utils.data import Dataset
+from app.inference import MODEL_SPECS, load_image, to_tensor
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+MANIFEST_FIELDS = ["path", "label", "phash", "group", "duplicates", "split"]
+HASH_SIZE = 8  # 8x8 low-frequency DCT block -> 64-bit hash
+DCT_SIZE = 32
+NUM_BLOCKS = 4  # 64-bit hash split into 16-bit blocks for the multi-index lookup
+BLOCK_BITS = 64 // NUM_BLOCKS
+
+def _dct_matrix(n):
+    k = np.arange(n)[:, None]
+    m = np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    m[0] /= np.sqrt(2)
+    return m.astype(np.float32)
+
+DCT = _dct_matrix(DCT_SIZE)
+POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+def phash(path):
+    """64-bit DCT perceptual hash: bits of the 8x8 lowest frequencies above their median.
+    Returns None for unreadable files."""
+    try:
+        with Image.open(path) as img:
+            gray = np.asarray(img.convert("L").resize((DCT_SIZE, DCT_SIZE), Image.LANCZOS), dtype=np.float32)
+    except Exception:
+        return None
+    low = (DCT @ gray @ DCT.T)[:HASH_SIZE, :HASH_SIZE].ravel()
+    bits = low > np.median(low[1:])  # the DC term would skew the median
+    return int(np.packbits(bits).view(">u8")[0])
+
+def popcount(x):
+    if hasattr(np, "bitwise_count"):  # numpy >= 2.0
+        return np.bitwise_count(x)
+    return POPCOUNT8[x.view(np.uint8).reshape(-1, 8)].sum(axis=1)
+
+def list_images(root):
+    """(path, label) for every image under root/<label>/, sorted for reproducible manifests."""
+    items = []
+    for label in sorted(os.listdir(root)):
+        label_dir = os.path.join(root, label)
+        if not os.path.isdir(label_dir):
+            continue
+        for dirpath, _, filenames in os.walk(label_dir):
+            items += [(os.path.join(dirpath, f), label) for f in filenames if f.lower().endswith(IMAGE_EXTENSIONS)]
+    return sorted(items)
+
+def hash_images(paths, workers=None, chunksize=256):
+    """Perceptual hashes for paths in parallel; None where an image could not be read."""
+    ctx = mp.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+        return list(pool.map(phash, paths, chunksize=chunksize))
+
+def _probe_masks(radius):
+    """All BLOCK_BITS-bit masks with at most radius bits set."""
+    masks = [0]
+    for _ in range(radius):
+        masks = sorted({m | (1 << b) for m in masks for b in range(BLOCK_BITS)} | set(masks))
+    return np.array(masks, dtype=np.uint64)
+
+def near_duplicate_pairs(hashes, max_distance, chunk=65536):
+    """Index pairs (i < j) of hashes within max_distance bits, as an (n, 2) array.
+
+    Multi-index hashing: split each hash into NUM_BLOCKS blocks; two hashes within d bits
+    have at least one block within d // NUM_BLOCKS bits (pigeonhole). So per block we only
+    look up the few block values within that radius in a bucket table, then verify the
+    full Hamming distance of those candidates."""
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    masks = _probe_masks(max_distance // NUM_BLOCKS).astype(np.int64)
+    block_mask = np.uint64((1 << BLOCK_BITS) - 1)
+    pairs = []
+    for b in range(NUM_BLOCKS):
+        blocks = ((hashes >> np.uint64(b * BLOCK_BITS)) & block_mask).astype(np.int64)
+        # bucket table: items with block value v are order[offsets[v]:offsets[v + 1]]
+        order = np.argsort(blocks, kind="stable")
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(blocks, minlength=1 << BLOCK_BITS))])
+        for mask in masks:
+            for start in range(0, len(hashes), chunk):
+                q = np.arange(start, min(start + chunk, len(hashes)))
+                keys = blocks[q] ^ mask
+                lo = offsets[keys]
+                counts = offsets[keys + 1] - lo
+                if not counts.any():
+                    continue
+                qi = np.repeat(q, counts)
+                # positions lo..hi-1 of every query, flattened
+                pos = np.repeat(lo - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+                cj = order[pos]
+                keep = (qi < cj) & (popcount(hashes[qi] ^ hashes[cj]) <= max_distance)
+                pairs.append(np.stack([qi[keep], cj[keep]], axis=1))
+    if not pairs:
+        return np.empty((0, 2), dtype=np.int64)
+    # a pair close in several blocks is found once per block
+    return np.unique(np.concatenate(pairs), axis=0)
+
+def group_duplicates(hashes, max_distance):
+    """Group id per item: connected components of the near-duplicate graph (union-find).
+    Exact hash matches are collapsed first, so heavily repeated images cost nothing extra."""
+    unique, inverse = np.unique(np.asarray(hashes, dtype=np.uint64), return_inverse=True)
+    parent = list(range(len(unique)))
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    for i, j in near_duplicate_pairs(unique, max_distance):
+        ri, rj = find(int(i)), find(int(j))
+        if ri != rj:
+            parent[max(ri, rj)] = min(ri, rj)
+    roots = np.array([find(i) for i in range(len(unique))], dtype=np.int64)
+    return roots[inverse.ravel()]
+
+def assign_split(key, val_fraction, test_fraction):
+    """Split from a hash of the group key, independent of file order and dataset size."""
+    u = int(hashlib.sha1(key.encode()).hexdigest()[:8], 16) / 0x100000000
+    if u < test_fraction:
+        return "test"
+    if u < test_fraction + val_fraction:
+        return "val"
+    return "train"
+
+def build_manifest(root, out_path, target=None, max_distance=6, val_fraction=0.1, test_fraction=0.1, workers=None):
+    items = list_images(root)
+    if target is not None:
+        unknown = sorted({label for _, label in items} - set(MODEL_SPECS[target][1]))
+        if unknown:
+            raise ValueError(f"Labels not served for {target}: {', '.join(unknown)}")
+    start = time.perf_counter()
+    hashes = hash_images([path for path, _ in items], workers=workers)
+    unreadable = sum(h is None for h in hashes)
+    items = [(path, label, h) for (path, label), h in zip(items, hashes) if h is not None]
+    print(f"Hashed {len(items)} images in {time.perf_counter() - start:.1f}s ({unreadable} unreadable)")
+
+    start = time.perf_counter()
+    groups = group_duplicates([h for _, _, h in items], max_distance)
+    members = {}
+    for item, g in zip(items, groups):
+        members.setdefault(int(g), []).append(item)
+    print(f"Grouped near-duplicates (<= {max_distance} bits) in {time.perf_counter() - start:.1f}s")
+
+    rows, conflicts = [], 0
+    for group in members.values():
+        # representative: first path; label: majority vote (near-duplicates labelled differently are noise)
+        labels = Counter(label for _, label, _ in group)
+        conflicts += len(labels) > 1
+        label = labels.most_common(1)[0][0]
+        path, _, h = next(item for item in group if item[1] == label)
+        key = f"{h:016x}"
+        rows.append({"path": os.path.abspath(path), "label": label, "phash": key, "group": key,
+                     "duplicates": len(group) - 1, "split": assign_split(key, val_fraction, test_fraction)})
+
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=MANIFEST_FIELDS)
+        writer.writeheader()
+        writer.writerows(sorted(rows, key=lambda r: r["path"]))
+    os.replace(tmp_path, out_path)
+    splits = Counter(r["split"] for r in rows)
+    print(f"Wrote {out_path}: {len(rows)} of {len(items)} images kept, "
+          f"{len(items) - len(rows)} near-duplicates dropped, {conflicts} groups with conflicting labels, "
+          f"splits {dict(sorted(splits.items()))}")
+    return rows
+
+def read_manifest(path):
+    with open(path, newline="") as f:
+        return list(csv.DictReader(f))
+
+def check_leakage(manifest_path, max_distance=6):
+    """Near-duplicate pairs that sit in different splits of a manifest (e.g. one edited or
+    merged by hand); returns [(path_a, split_a, path_b, split_b, distance)]."""
+    rows = read_manifest(manifest_path)
+    hashes = np.array([int(r["phash"], 16) for r in rows], dtype=np.uint64)
+    leaks = []
+    for i, j in near_duplicate_pairs(hashes, max_distance):
+        a, b = rows[i], rows[j]
+        if a["split"] != b["split"]:
+            leaks.append((a["path"], a["split"], b["path"], b["split"], bin(int(hashes[i] ^ hashes[j])).count("1")))
+    print(f"{manifest_path}: {len(leaks)} near-duplicate pairs across splits")
+    return leaks
+
+class ManifestDataset(Dataset):
+    """One split of a manifest, preprocessed exactly like the serving path (app.inference)."""
+
+    def __init__(self, manifest_path, split, labels):
+        self.rows = [r for r in read_manifest(manifest_path) if r["split"] == split]
+        self.labels = labels
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, i):
+        row = self.rows[i]
+        with open(row["path"], "rb") as f:
+            x = to_tensor(load_image(f.read()))
+        return x, torch.tensor(self.labels.index(row["label"]))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deduplicate an image dataset by perceptual hash and write split manifest.")
+    parser.add_argument("root", nargs="?", help="dataset folder with one subfolder per label")
+    parser.add_argument("--target", choices=sorted(MODEL_SPECS), help="check labels against the served model's classes")
+    parser.add_argument("--out", help="manifest CSV path (default: <root>/manifest.csv)")
+    parser.add_argument("--max-distance", type=int, default=6, help="Hamming distance (of 64 bits) counted as a near-duplicate")
+    parser.add_argument("--val-fraction", type=float, default=0.1)
+    parser.add_argument("--test-fraction", type=float, default=0.1)
+    parser.add_argument("--workers", type=int, default=None, help="hashing processes (default: all cores)")
+    parser.add_argument("--check", metavar="MANIFEST", help="only report cross-split near-duplicates in a manifest")
+    args = parser.parse_args()
+
+    if args.check:
+        for leak in check_leakage(args.check, args.max_distance)[:20]:
+            print("  {} [{}] ~ {} [{}] ({} bits)".format(*leak))
+    elif args.root:
+        build_manifest(args.root, args.out or os.path.join(args.root, "manifest.csv"), target=args.target,
+                       max_distance=args.max_distance, val_fraction=args.val_fraction,
+                       test_fraction=args.test_fraction, workers=args.workers)
+    else:
+        parser.error("give a dataset root or --check MANIFEST")
@@ -0,0 +1,185 @@
+# training/sweep.py
+"""
+Hyperparameter sweep over learning rate, batch size and augmentation for SmallCNN.
+
+Trials run as parallel processes inside a core budget. They all memory-map one cached,
+preprocessed dataset file, report per-epoch validation loss so weak trials are pruned early
+(median rule), and each finished trial is appended to a JSONL results file. Re-running the
+same sweep skips configurations already recorded there.
+
+    python -m app.training.sweep --target brain --mode grid --cores 8 --threads-per-trial 2
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import torch
+import torch.multiprocessing as mp
+import torch.nn as nn
+import torch.optim as optim
+from torch.utils.data import DataLoader, TensorDataset
+from app.training.checkpoint import atomic_save
+from app.training.train_dummy_models import (TARGETS, build_model, evaluate, make_dummy_dataset,
+                                             split_dataset, train_epoch)
+
+CACHE_DIR = os.path.join("models", "sweep_cache")
+RESULTS_PATH = os.path.join("models", "sweep_results.jsonl")
+
+AUGMENTATIONS = {
+    "none": lambda x: x,
+    "hflip": lambda x: torch.where(torch.rand(x.size(0), 1, 1, 1) < 0.5, x.flip(3), x),
+    "hflip+noise": lambda x: AUGMENTATIONS["hflip"](x) + 0.05 * torch.randn_like(x),
+}
+
+class AugmentedLoader:
+    """Wraps a DataLoader and applies a batch-level augmentation to the inputs."""
+
+    def __init__(self, loader, augment):
+        self.loader = loader
+        self.augment = AUGMENTATIONS[augment]
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __iter__(self):
+        for xb, yb in self.loader:
+            yield self.augment(xb), yb
+
+def cache_name(num_classes, n=100, seed=0, val_fraction=0.2):
+    """Identity of a cached dataset; part of every trial config so results are tied to their data."""
+    return f"c{num_classes}_n{n}_s{seed}_v{val_fraction}"
+
+def build_cache(num_classes, n=100, seed=0, val_fraction=0.2):
+    """Preprocesses the dataset once and stores train/val tensors in a single file trials can mmap."""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = os.path.join(CACHE_DIR, cache_name(num_classes, n=n, seed=seed, val_fraction=val_fraction) + ".pt")
+    if not os.path.exists(path):
+        train_ds, val_ds = split_dataset(make_dummy_dataset(num_classes, n=n, seed=seed), val_fraction, seed=seed)
+        X, y = train_ds.dataset.tensors
+        atomic_save({
+            "train": (X[train_ds.indices].contiguous(), y[train_ds.indices].contiguous()),
+            "val": (X[val_ds.indices].contiguous(), y[val_ds.indices].contiguous()),
+        }, path)
+    return path
+
+def config_key(config):
+    return json.dumps(config, sort_keys=True)
+
+def load_done(results_path):
+    if not os.path.exists(results_path):
+        return {}
+    with open(results_path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return {config_key(r["config"]): r for r in records}
+
+def make_configs(space, mode="grid", trials=10, seed=0):
+    names = sorted(space)
+    grid = [dict(zip(names, values)) for values in itertools.product(*(space[n] for n in names))]
+    if mode == "grid":
+        return grid
+    return random.Random(seed).sample(grid, min(trials, len(grid)))
+
+def _init_worker(num_threads):
+    torch.set_num_threads(num_threads)
+
+def run_trial(config, cache_path, reports, lock, min_reports=3):
+    """Trains one configuration; returns its metrics record. reports is a shared list of
+    (epoch, val_loss) from every trial, used for median pruning."""
+    start = time.perf_counter()
+    data = torch.load(cache_path, mmap=True)
+    train_ds, val_ds = TensorDataset(*data["train"]), TensorDataset(*data["val"])
+    loader = AugmentedLoader(DataLoader(train_ds, batch_size=config["batch_size"], shuffle=True),
+                             config["augment"])
+    val_loader = DataLoader(val_ds, batch_size=64)
+
+    model, _ = build_model(config["num_classes"])
+    criterion = nn.CrossEntropyLoss()
+    opt = optim.Adam(model.parameters(), lr=config["lr"])
+
+    history, status = [], "completed"
+    for ep in range(config["epochs"]):
+        train_epoch(model, loader, criterion, opt)
+        val_loss, val_acc = evaluate(model, val_loader, criterion)
+        history.append({"epoch": ep + 1, "val_loss": val_loss, "val_acc": val_acc})
+        with lock:
+            peers = [v for e, v in reports if e == ep + 1]
+            reports.append((ep + 1, val_loss))
+        # median rule: stop if worse than the median of other trials at the same epoch
+        if ep + 1 < config["epochs"] and len(peers) >= min_reports and val_loss > statistics.median(peers):
+            status = "pruned"
+            break
+
+    best = min(history, key=lambda h: h["val_loss"])
+    return {
+        "config": config,
+        "status": status,
+        "epochs_run": len(history),
+        "best_val_loss": best["val_loss"],
+        "best_val_acc": best["val_acc"],
+        "history": history,
+        "wall_time_s": round(time.perf_counter() - start, 2),
+    }
+
+def run_sweep(target, space, mode="grid", trials=10, epochs=3, cores=None, threads_per_trial=1,
+              results_path=RESULTS_PATH, seed=0):
+    num_classes, _ = TARGETS[target]
+    # seed and dataset belong to the key: a config trained on other data is not "already done"
+    dataset = cache_name(num_classes, seed=seed)
+    configs = [dict(c, target=target, num_classes=num_classes, epochs=epochs, seed=seed, dataset=dataset)
+               for c in make_configs(space, mode=mode, trials=trials, seed=seed)]
+    done = load_done(results_path)
+    todo = [c for c in configs if config_key(c) not in done]
+    print(f"Sweep: {len(configs)} configs, {len(configs) - len(todo)} already done, {len(todo)} to run")
+    if not todo:
+        return list(done.values())
+
+    cache_path = build_cache(num_classes, seed=seed)
+    workers = max(1, (cores or os.cpu_count() or 1) // threads_per_trial)
+    ctx = mp.get_context("spawn")
+    manager = ctx.Manager()
+    # seed the pruner with per-epoch results from earlier runs of this target on the same data
+    reports = manager.list([(h["epoch"], h["val_loss"]) for r in done.values()
+                            if r["config"].get("target") == target and r["config"].get("dataset") == dataset
+                            for h in r["history"]])
+    lock = manager.Lock()
+
+    os.makedirs(os.path.dirname(results_path) or ".", exist_ok=True)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker,
+                             initargs=(threads_per_trial,)) as pool:
+        futures = {pool.submit(run_trial, c, cache_path, reports, lock): c for c in todo}
+        for fut in as_completed(futures):
+            record = fut.result()
+            # only the parent appends, so the results file never sees interleaved writes
+            with open(results_path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+            done[config_key(record["config"])] = record
+            print(f"[{record['status']}] {record['config']} best_val_loss: {record['best_val_loss']:.4f} "
+                  f"({record['wall_time_s']}s)")
+    manager.shutdown()
+    return list(done.values())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parallel hyperparameter sweep for SmallCNN.")
+    parser.add_argument("--target", choices=sorted(TARGETS), required=True)
+    parser.add_argument("--mode", choices=["grid", "random"], default="grid")
+    parser.add_argument("--trials", type=int, default=10, help="number of configs sampled in random mode")
+    parser.add_argument("--lrs", type=float, nargs="+", default=[1e-4, 3e-4, 1e-3, 3e-3])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[8, 16, 32])
+    parser.add_argument("--augments", nargs="+", choices=sorted(AUGMENTATIONS), default=["none", "hflip"])
+    parser.add_argument("--epochs", type=int, default=3)
+    parser.add_argument("--cores", type=int, default=None, help="total core budget (default: all cores)")
+    parser.add_argument("--threads-per-trial", type=int, default=1)
+    parser.add_argument("--results", default=RESULTS_PATH)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    space = {"lr": args.lrs, "batch_size": args.batch_sizes, "augment": args.augments}
+    records = run_sweep(args.target, space, mode=args.mode, trials=args.trials, epochs=args.epochs,
+                        cores=args.cores, threads_per_trial=args.threads_per_trial,
+                        results_path=args.results, seed=args.seed)
+    best = min((r for r in records if r["config"].get("target") == args.target), key=lambda r: r["best_val_loss"])
+    print(f"Best: {best['config']} val_loss: {best['best_val_loss']:.4f}")
@@ -0,0 +1,98 @@
+# training/train_ddp.py
+"""
+Data-parallel training of SmallCNN across CPU processes (and nodes) with the gloo backend.
+
+Single multi-core box, 4 processes:
+    torchrun --standalone --nproc_per_node=4 -m app.training.train_ddp --target brain
+
+Several nodes (run on each node, same rendezvous endpoint):
+    torchrun --nnodes=2 --nproc_per_node=4 --rdzv_backend=c10d --rdzv_endpoint=HOST:29500 \
+        -m app.training.train_ddp --target brain
+"""
+import argparse
+import os
+import torch
+import torch.distributed as dist
+import torch.nn as nn
+import torch.optim as optim
+from torch.nn.parallel import DistributedDataParallel as DDP
+from torch.utils.data import DataLoader
+from torch.utils.data.distributed import DistributedSampler
+from app.training.checkpoint import atomic_save, latest_checkpoint, load_checkpoint, positive_int, save_checkpoint
+from app.inference import MODEL_SPECS
+from app.training.dataset_index import ManifestDataset
+from app.training.train_dummy_models import TARGETS, build_model, make_dummy_dataset, train_epoch
+
+device = torch.device("cpu")
+
+def train_ddp(num_classes, save_path, epochs=3, batch_size=8, lr=1e-3, seed=0,
+              bf16=False, channels_last=False, accum_steps=1, keep_last=3, resume=False,
+              manifest=None, labels=None):
+    rank = dist.get_rank()
+    world_size = dist.get_world_size()
+
+    # every rank builds the same dataset; the sampler hands each one a disjoint shard
+    ds = ManifestDataset(manifest, "train", labels) if manifest else make_dummy_dataset(num_classes, seed=seed)
+    sampler = DistributedSampler(ds, num_replicas=world_size, rank=rank, shuffle=True, seed=seed)
+    loader = DataLoader(ds, batch_size=batch_size, sampler=sampler)
+
+    # DDP broadcasts rank 0's initial weights and averages gradients on backward
+    model, _ = build_model(num_classes, channels_last=channels_last, device=device)
+    ddp_model = DDP(model)
+    criterion = nn.CrossEntropyLoss()
+    opt = optim.Adam(ddp_model.parameters(), lr=lr)
+
+    # every rank restores the same checkpoint (nodes need a shared models/ directory)
+    start_epoch = 0
+    ckpt = latest_checkpoint(save_path) if resume else None
+    if ckpt:
+        start_epoch = load_checkpoint(ckpt, model, opt)["epoch"]
+        if rank == 0:
+            print(f"[{save_path}] Resumed from {ckpt} (epoch {start_epoch})")
+
+    for ep in range(start_epoch, epochs):
+        sampler.set_epoch(ep)
+        loss, throughput = train_epoch(ddp_model, loader, criterion, opt, bf16=bf16,
+                                       channels_last=channels_last, accum_steps=accum_steps, device=device)
+        stats = torch.tensor([loss, throughput])
+        dist.all_reduce(stats)
+        if rank == 0:
+            print(f"[{save_path}] Epoch {ep+1}/{epochs} loss: {stats[0] / world_size:.4f} "
+                  f"({stats[1]:.1f} samples/s across {world_size} ranks)")
+            save_checkpoint(save_path, ep + 1, model, opt, keep_last=keep_last)
+        dist.barrier()
+
+    if rank == 0:
+        atomic_save(model.state_dict(), save_path)
+        print(f"Saved DDP model to {save_path}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="DDP training of SmallCNN (launch with torchrun).")
+    parser.add_argument("--target", choices=sorted(TARGETS), required=True)
+    parser.add_argument("--epochs", type=int, default=2)
+    parser.add_argument("--batch-size", type=int, default=8, help="per-process batch size")
+    parser.add_argument("--lr", type=float, default=1e-3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--bf16", action="store_true")
+    parser.add_argument("--channels-last", action="store_true")
+    parser.add_argument("--accum-steps", type=int, default=1)
+    parser.add_argument("--keep-last", type=positive_int, default=3)
+    parser.add_argument("--resume", action="store_true")
+    parser.add_argument("--manifest", default=None, help="train on a dataset_index manifest instead of dummy data")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="intra-op threads per process (default: cores / local processes)")
+    args = parser.parse_args()
+
+    # torchrun pins OMP_NUM_THREADS=1; give each local rank its share of the cores instead
+    local_world_size = int(os.environ.get("LOCAL_WORLD_SIZE", "1"))
+    torch.set_num_threads(args.threads or max(1, (os.cpu_count() or 1) // local_world_size))
+
+    dist.init_process_group(backend="gloo")
+    try:
+        num_classes, save_path = TARGETS[args.target]
+        train_ddp(num_classes, save_path, epochs=args.epochs, batch_size=args.batch_size, lr=args.lr,
+                  seed=args.seed, bf16=args.bf16, channels_last=args.channels_last,
+                  accum_steps=args.accum_steps, keep_last=args.keep_last, resume=args.resume,
+                  manifest=args.manifest, labels=MODEL_SPECS[args.target][1])
+    finally:
+        dist.destroy_process_group()
@@ -1,43 +1,233 @@
 # training/train_dummy_models.py
+import argparse
+import contextlib
 import os
+import time
 import torch
+import torch.multiprocessing as mp
 import torch.nn as nn
 import torch.optim as optim
-from torch.utils.data import DataLoader, TensorDataset
+from torch.utils.data import DataLoader, TensorDataset, random_split
+from app.inference import MODEL_SPECS
 from app.models import SmallCNN
+from app.training.checkpoint import atomic_save, latest_checkpoint, load_checkpoint, positive_int, save_checkpoint
+from app.training.dataset_index import ManifestDataset
 
 os.makedirs("models", exist_ok=True)
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
-def train_dummy(num_classes, save_path, epochs=3):
-    # create random dataset: 100 samples of 3x224x224
-    X = torch.randn(100, 3, 224, 224)
-    y = torch.randint(0, num_classes, (100,))
-    ds = TensorDataset(X, y)
-    loader = DataLoader(ds, batch_size=8, shuffle=True)
+# target -> (num_classes, save_path)
+TARGETS = {
+    "brain": (4, "models/brain_model.pt"),
+    "eye": (3, "models/retina_model.pt"),
+}
 
+def make_dummy_dataset(num_classes, n=100, seed=None):
+    # create random dataset: n samples of 3x224x224
+    # pass a seed when several processes must see the same dataset (e.g. DDP ranks)
+    gen = torch.Generator().manual_seed(seed) if seed is not None else None
+    X = torch.randn(n, 3, 224, 224, generator=gen)
+    y = torch.randint(0, num_classes, (n,), generator=gen)
+    return TensorDataset(X, y)
+
+def build_model(num_classes, channels_last=False, compile=False, device=device):
+    """Returns (model, train_model): train_model is the compiled wrapper when compile=True,
+    model is always the plain module whose state_dict gets saved."""
     model = SmallCNN(num_classes=num_classes).to(device)
-    criterion = nn.CrossEntropyLoss()
-    opt = optim.Adam(model.parameters(), lr=1e-3)
+    if channels_last:
+        model = model.to(memory_format=torch.channels_last)
+    train_model = torch.compile(model) if compile else model
+    return model, train_model
+
+def train_epoch(train_model, loader, criterion, opt, bf16=False, channels_last=False, accum_steps=1, device=device):
+    """Runs one epoch and returns (mean loss, samples/sec)."""
+    train_model.train()
+    running = 0.0
+    samples = 0
+    start = time.perf_counter()
+    opt.zero_grad()
+    for i, (xb, yb) in enumerate(loader):
+        xb = xb.to(device)
+        yb = yb.to(device)
+        if channels_last:
+            xb = xb.contiguous(memory_format=torch.channels_last)
+        step = (i + 1) % accum_steps == 0 or i + 1 == len(loader)
+        # under DDP, skip the gradient all-reduce on micro-batches that don't end in an optimizer step
+        no_sync = train_model.no_sync() if not step and hasattr(train_model, "no_sync") else contextlib.nullcontext()
+        with no_sync:
+            with torch.autocast(device_type=device.type, dtype=torch.bfloat16, enabled=bf16):
+                logits = train_model(xb)
+                loss = criterion(logits, yb)
+            # scale so the accumulated gradient matches one batch of batch_size * accum_steps
+            (loss / accum_steps).backward()
+        if step:
+            opt.step()
+            opt.zero_grad()
+        running += loss.item()
+        samples += xb.size(0)
+    return running / len(loader), samples / (time.perf_counter() - start)
 
-    model.train()
-    for ep in range(epochs):
-        running = 0.0
+def evaluate(model, loader, criterion, bf16=False, channels_last=False, device=device):
+    """Returns (mean loss, accuracy) over loader without updating the model."""
+    model.eval()
+    total_loss, correct, n = 0.0, 0, 0
+    with torch.inference_mode():
         for xb, yb in loader:
             xb = xb.to(device)
             yb = yb.to(device)
-            opt.zero_grad()
-            logits = model(xb)
-            loss = criterion(logits, yb)
-            loss.backward()
-            opt.step()
-            running += loss.item()
-        print(f"[{save_path}] Epoch {ep+1}/{epochs} loss: {running/len(loader):.4f}")
+            if channels_last:
+                xb = xb.contiguous(memory_format=torch.channels_last)
+            with torch.autocast(device_type=device.type, dtype=torch.bfloat16, enabled=bf16):
+                logits = model(xb)
+                total_loss += criterion(logits.float(), yb).item() * xb.size(0)
+            correct += (logits.argmax(1) == yb).sum().item()
+            n += xb.size(0)
+    return total_loss / n, correct / n
+
+def split_dataset(ds, val_fraction, seed=0):
+    """Deterministic train/val split, so a resumed run validates on the same held-out samples."""
+    n_val = int(len(ds) * val_fraction)
+    return random_split(ds, [len(ds) - n_val, n_val], generator=torch.Generator().manual_seed(seed))
+
+def load_datasets(num_classes, val_fraction, seed=0, manifest=None, labels=None):
+    """(train, val) datasets: the train/val splits of a dataset_index manifest when given
+    (labels maps its label names to class indices), else a split of random dummy data."""
+    if manifest is not None:
+        return ManifestDataset(manifest, "train", labels), ManifestDataset(manifest, "val", labels)
+    return split_dataset(make_dummy_dataset(num_classes, seed=seed), val_fraction, seed=seed)
+
+def train_dummy(num_classes, save_path, epochs=3, batch_size=8, lr=1e-3,
+                bf16=False, channels_last=False, compile=False, accum_steps=1,
+                val_fraction=0.2, patience=None, keep_last=3, resume=False, seed=0,
+                manifest=None, labels=None):
+    train_ds, val_ds = load_datasets(num_classes, val_fraction, seed=seed, manifest=manifest, labels=labels)
+    loader = DataLoader(train_ds, batch_size=batch_size, shuffle=True)
+    val_loader = DataLoader(val_ds, batch_size=batch_size) if len(val_ds) else None
+
+    model, train_model = build_model(num_classes, channels_last=channels_last, compile=compile)
+    criterion = nn.CrossEntropyLoss()
+    opt = optim.Adam(model.parameters(), lr=lr)
+
+    start_epoch = 0
+    best_val, best_state, bad_epochs = float("inf"), None, 0
+    ckpt = latest_checkpoint(save_path) if resume else None
+    if ckpt:
+        state = load_checkpoint(ckpt, model, opt)
+        start_epoch = state["epoch"]
+        # train_ddp checkpoints share the name pattern but carry no early-stopping state
+        best_val = state.get("best_val", float("inf"))
+        best_state, bad_epochs = state.get("best_state"), state.get("bad_epochs", 0)
+        print(f"[{save_path}] Resumed from {ckpt} (epoch {start_epoch})")
+        if patience is not None and bad_epochs >= patience:
+            print(f"[{save_path}] Already early-stopped: no val improvement for {patience} epochs")
+            start_epoch = epochs
+
+    for ep in range(start_epoch, epochs):
+        loss, throughput = train_epoch(train_model, loader, criterion, opt,
+                                       bf16=bf16, channels_last=channels_last, accum_steps=accum_steps)
+        msg = f"[{save_path}] Epoch {ep+1}/{epochs} loss: {loss:.4f} ({throughput:.1f} samples/s)"
+
+        if val_loader is not None:
+            val_loss, val_acc = evaluate(model, val_loader, criterion, bf16=bf16, channels_last=channels_last)
+            msg += f" val_loss: {val_loss:.4f} val_acc: {val_acc:.3f}"
+            if val_loss < best_val:
+                best_val, bad_epochs = val_loss, 0
+                best_state = {k: v.detach().clone() for k, v in model.state_dict().items()}
+            else:
+                bad_epochs += 1
+        print(msg)
+
+        save_checkpoint(save_path, ep + 1, model, opt, keep_last=keep_last,
+                        best_val=best_val, best_state=best_state, bad_epochs=bad_epochs)
+
+        if patience is not None and bad_epochs >= patience:
+            print(f"[{save_path}] Early stopping: no val improvement for {patience} epochs")
+            break
 
-    # save state_dict
-    torch.save(model.state_dict(), save_path)
+    # save state_dict (best validation weights when a held-out split is used)
+    if best_state is not None:
+        model.load_state_dict(best_state)
+    atomic_save(model.state_dict(), save_path)
     print(f"Saved dummy model to {save_path}")
 
+# option name -> train_epoch/build_model kwargs, compared against plain fp32 NCHW
+BENCHMARK_OPTIONS = {
+    "fp32": {},
+    "bf16": {"bf16": True},
+    "channels_last": {"channels_last": True},
+    "bf16+channels_last": {"bf16": True, "channels_last": True},
+    "compile": {"compile": True},
+    "accum4": {"accum_steps": 4},
+}
+
+def benchmark_options(num_classes=4, batch_size=8, epochs=2):
+    """Trains briefly with each option and prints throughput relative to the fp32 baseline.
+    The first epoch is discarded as warm-up (compile and oneDNN JIT happen there)."""
+    loader = DataLoader(make_dummy_dataset(num_classes), batch_size=batch_size, shuffle=True)
+    results = {}
+    for name, opts in BENCHMARK_OPTIONS.items():
+        model, train_model = build_model(num_classes, channels_last=opts.get("channels_last", False),
+                                         compile=opts.get("compile", False))
+        opt = optim.Adam(model.parameters(), lr=1e-3)
+        epoch_opts = {k: v for k, v in opts.items() if k != "compile"}
+        for _ in range(epochs):
+            _, throughput = train_epoch(train_model, loader, nn.CrossEntropyLoss(), opt, **epoch_opts)
+        results[name] = throughput
+    base = results["fp32"]
+    for name, throughput in results.items():
+        print(f"{name:>20}: {throughput:8.1f} samples/s ({throughput / base:.2f}x vs fp32)")
+    return results
+
+def _train_worker(num_threads, kwargs):
+    torch.set_num_threads(num_threads)
+    train_dummy(**kwargs)
+
+def train_concurrently(jobs):
+    """Trains several models at once, one process each, splitting the CPU cores between them."""
+    num_threads = max(1, (os.cpu_count() or 1) // len(jobs))
+    ctx = mp.get_context("spawn")
+    procs = [ctx.Process(target=_train_worker, args=(num_threads, kwargs)) for kwargs in jobs]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    failed = [kwargs["save_path"] for p, kwargs in zip(procs, jobs) if p.exitcode != 0]
+    if failed:
+        raise RuntimeError(f"Training failed for: {', '.join(failed)}")
+
 if __name__ == "__main__":
-    train_dummy(num_classes=4, save_path="models/brain_model.pt", epochs=2)
-    train_dummy(num_classes=3, save_path="models/retina_model.pt", epochs=2)
+    parser = argparse.ArgumentParser(description="Train the dummy brain and retina models.")
+    parser.add_argument("--epochs", type=int, default=2)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--lr", type=float, default=1e-3)
+    parser.add_argument("--bf16", action="store_true", help="bf16 autocast for forward/loss")
+    parser.add_argument("--channels-last", action="store_true", help="NHWC memory format for model and inputs")
+    parser.add_argument("--compile", action="store_true", help="torch.compile SmallCNN")
+    parser.add_argument("--accum-steps", type=int, default=1, help="gradient accumulation steps per optimizer step")
+    parser.add_argument("--val-fraction", type=float, default=0.2, help="held-out fraction for validation")
+    parser.add_argument("--patience", type=int, default=None, help="stop after this many epochs without val improvement")
+    parser.add_argument("--keep-last", type=positive_int, default=3, help="number of periodic checkpoints to retain")
+    parser.add_argument("--resume", action="store_true", help="continue from the latest checkpoint in models/")
+    parser.add_argument("--manifest", action="append", default=[], metavar="TARGET=CSV",
+                        help="train TARGET on a dataset_index manifest instead of dummy data (repeatable)")
+    parser.add_argument("--benchmark", action="store_true", help="compare throughput of each option and exit")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark_options(batch_size=args.batch_size)
+    else:
+        opts = dict(epochs=args.epochs, batch_size=args.batch_size, lr=args.lr, bf16=args.bf16,
+                    channels_last=args.channels_last, compile=args.compile, accum_steps=args.accum_steps,
+                    val_fraction=args.val_fraction, patience=args.patience, keep_last=args.keep_last,
+                    resume=args.resume)
+        manifests = dict(m.split("=", 1) for m in args.manifest)
+        unknown = sorted(set(manifests) - set(TARGETS))
+        if unknown:
+            parser.error(f"unknown --manifest target(s): {', '.join(unknown)}")
+        jobs = []
+        for target, (n, path) in TARGETS.items():
+            job = dict(num_classes=n, save_path=path, **opts)
+            if target in manifests:
+                job.update(manifest=manifests[target], labels=MODEL_SPECS[target][1])
+            jobs.append(job)
+        train_concurrently(jobs)
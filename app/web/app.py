@@ -2,6 +2,8 @@ import streamlit as st
 from PIL import Image
 import time
 import base64  # Required for Base64 image embedding
+import hashlib  # Content hash for deduplicated uploads
+import io
 import os  # Required to check file paths
 
 # --- FILE PATH SETUP (NEW ROBUSTNESS) ---
@@ -9,6 +11,14 @@ import os  # Required to check file paths
 # This handles cases where the user runs streamlit from a different directory (e.g., the project root)
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 
+# --- BACKEND ENDPOINTS ---
+BACKEND_BASE_URL = os.environ.get("BACKEND_BASE_URL", "http://localhost:8000")  # Change to your actual backend
+JOB_POLL_SECONDS = 1.0  # How often the result page checks a queued job
+SIMILAR_CASES = 4  # Past cases shown under a result (nearest by model embedding)
+# Shrink images to the model's input resolution before hashing/uploading (backend resizes to this anyway)
+CLIENT_DOWNSCALE = True
+MODEL_INPUT_SIZE = 224
+
 # --- CONFIGURATION & SETUP ---
 st.set_page_config(
     page_title="Cancer Detector",
@@ -35,11 +45,22 @@ if "show_predict_warning" not in st.session_state:
 # New state to store the page before navigating to History
 if "history_source_page" not in st.session_state:
     st.session_state.history_source_page = "home"
+# Id of the backend job currently being analyzed (polled on the result page)
+if "job_id" not in st.session_state:
+    st.session_state.job_id = None
+# Error from the last predict click, shown on the home page
+if "predict_error" not in st.session_state:
+    st.session_state.predict_error = None
+# (image sha256, target) -> similar past cases from the backend, fetched once per result
+if "similar_cases" not in st.session_state:
+    st.session_state.similar_cases = {}
 
 
 # --- BASE64 HELPER FUNCTION ---
+@st.cache_resource
 def get_base64_image(relative_image_path):
-    """Reads a local image and converts it to a base64 string for embedding in HTML."""
+    """Reads a local image and converts it to a base64 string for embedding in HTML.
+    Cached: each icon is read and encoded once per server process, not on every rerun."""
     try:
         # Construct the full absolute path
         full_path = os.path.join(CURRENT_DIR, relative_image_path)
@@ -63,90 +84,131 @@ def get_base64_image(relative_image_path):
         return ""
 
 
+# --- UPLOAD HELPERS (HASH-FIRST PROTOCOL) ---
+def prepare_upload(uploaded_file):
+    """
+    Returns (payload_bytes, sha256, mime_type) for an uploaded file, optionally downscaled
+    to the model input size. Cached per file in session state so toggling type or
+    re-analyzing the same image doesn't re-encode or re-hash it.
+    """
+    cache_key = (getattr(uploaded_file, "file_id", uploaded_file.name), uploaded_file.size, CLIENT_DOWNSCALE)
+    cached = st.session_state.get("prepared_upload")
+    if cached and cached[0] == cache_key:
+        return cached[1]
+
+    payload, mime_type = uploaded_file.getvalue(), uploaded_file.type
+    if CLIENT_DOWNSCALE:
+        img = Image.open(io.BytesIO(payload)).convert("RGB")
+        if img.size != (MODEL_INPUT_SIZE, MODEL_INPUT_SIZE):
+            # Same squash-resize the backend applies, so the prediction is unchanged
+            img = img.resize((MODEL_INPUT_SIZE, MODEL_INPUT_SIZE), Image.BILINEAR)
+            buf = io.BytesIO()
+            img.save(buf, format="PNG")
+            payload, mime_type = buf.getvalue(), "image/png"
+
+    prepared = (payload, hashlib.sha256(payload).hexdigest(), mime_type)
+    st.session_state.prepared_upload = (cache_key, prepared)
+    return prepared
+
+
+def submit_job(uploaded_file, target, type_mode):
+    """
+    Hash-first submission: reference the image by sha256 and upload the bytes only if the
+    backend answers 404 (content not held yet). Returns the backend job id.
+    """
+    import requests
+    payload, digest, mime_type = prepare_upload(uploaded_file)
+    data = {"image_sha256": digest, "filename": uploaded_file.name, "target": target, "type": type_mode}
+    response = requests.post(f"{BACKEND_BASE_URL}/jobs", data=data, timeout=30)
+    if response.status_code == 404:
+        # Cache miss: send the bytes once, then retry the (tiny) job request
+        put = requests.put(f"{BACKEND_BASE_URL}/images/{digest}", data=payload,
+                           headers={"Content-Type": mime_type}, timeout=120)
+        put.raise_for_status()
+        response = requests.post(f"{BACKEND_BASE_URL}/jobs", data=data, timeout=30)
+    response.raise_for_status()
+    return response.json()["id"]
+
+
 # --- BUTTON HANDLER FUNCTION ---
 def handle_predict_click():
     """
     Handles the prediction logic when the Streamlit button is clicked.
     This replaces the query parameter trigger for prediction.
+    Submits an asynchronous job to the backend and returns right away;
+    the analysis result page polls for the outcome.
     """
     file_to_analyze = st.session_state.uploaded_file_data
 
     if file_to_analyze is not None:
-        import requests
         from requests.exceptions import RequestException
-        # Set the backend URL (update as needed)
-        BACKEND_URL = "http://localhost:8000/predict"  # Change to your actual endpoint
         # Determine target type and subtype
         target = "brain" if st.session_state.toggle else "eye"
         type_mode = st.session_state.type_toggle
         try:
-            files = {"file": (file_to_analyze.name, file_to_analyze, file_to_analyze.type)}
-            data = {"target": target, "type": type_mode}
-            response = requests.post(BACKEND_URL, files=files, data=data)
-            response.raise_for_status()
-            result_json = response.json()
-            # Store the result in session state for display
-            st.session_state.analysis_result = result_json
+            # Remember the job; the result page fills in analysis_result once it is done
+            st.session_state.job_id = submit_job(file_to_analyze, target, type_mode)
+            st.session_state.analysis_result = None
+            st.session_state.job_error = None
             # Add to history
             st.session_state.history_log.insert(0, f"Analyzed {file_to_analyze.name} as {target} ({type_mode})")
-            st.query_params.clear()
             st.session_state.page = "analysis_result"
             st.session_state.show_predict_warning = False
+            st.session_state.predict_error = None
         except RequestException as e:
             st.session_state.analysis_result = None
-            st.error(f"Prediction request failed: {e}")
+            st.session_state.predict_error = f"Prediction request failed: {e}"
         except Exception as e:
             st.session_state.analysis_result = None
-            st.error(f"Unexpected error: {e}")
+            st.session_state.predict_error = f"Unexpected error: {e}"
     else:
         st.session_state.page = "home"
         st.session_state.show_predict_warning = True
 
 
-# --- QUERY PARAMETER CLICK HANDLING ---
-query_params = st.query_params
-if "action" in query_params:
-    action = query_params["action"]
+# --- NAVIGATION CALLBACKS ---
+# The top bar uses native st.button widgets with these callbacks instead of <a href="?action=...">
+# links, so a click reruns only the fragment that owns the button instead of reloading the page.
+
+# 1. Handle Toggle Click
+def on_toggle_click():
+    st.session_state.toggle = not st.session_state.toggle
 
-    # 1. Handle Toggle Click
-    if action == "toggle":
-        st.session_state.toggle = not st.session_state.toggle
-        st.query_params.clear()
 
-    # 2. Handle History Click (Toggles between home/analysis and history) - UPDATED
-    elif action == "history":
-        if st.session_state.page != "history":
-            # Entering History: Store current page as source
-            st.session_state.history_source_page = st.session_state.page
-            st.session_state.page = "history"
+# 2. Handle History Click (Toggles between home/analysis and history)
+def on_history_click():
+    if st.session_state.page != "history":
+        # Entering History: Store current page as source
+        st.session_state.history_source_page = st.session_state.page
+        st.session_state.page = "history"
+    else:
+        # Clicking History when already on History: treat as a toggle OFF, go back to source
+        if "history_source_page" in st.session_state:
+            st.session_state.page = st.session_state.history_source_page
         else:
-            # Clicking History when already on History: treat as a toggle OFF, go back to source
-            if "history_source_page" in st.session_state:
-                st.session_state.page = st.session_state.history_source_page
-            else:
-                st.session_state.page = "home"  # Fallback
+            st.session_state.page = "home"  # Fallback
 
-        st.query_params.clear()
 
-    # 3. Handle Back Click (Used by Analysis Result and History pages) - UPDATED
-    elif action == "back":
-        if st.session_state.page == "history":
-            # Coming from History: go back to stored source page
-            target_page = st.session_state.get("history_source_page", "home")
-            st.session_state.page = target_page
+# 3. Handle Back Click (Used by Analysis Result and History pages)
+def on_back_click():
+    if st.session_state.page == "history":
+        # Coming from History: go back to stored source page
+        target_page = st.session_state.get("history_source_page", "home")
+        st.session_state.page = target_page
 
-            # Clean up history state since we've returned
-            if "history_source_page" in st.session_state:
-                del st.session_state.history_source_page
+        # Clean up history state since we've returned
+        if "history_source_page" in st.session_state:
+            del st.session_state.history_source_page
 
-        elif st.session_state.page == "analysis_result":
-            # Coming from Analysis Result: always go to home
-            st.session_state.page = "home"
+    elif st.session_state.page == "analysis_result":
+        # Coming from Analysis Result: always go to home
+        st.session_state.page = "home"
 
-        st.query_params.clear()
 
 # --- DARK THEME & CUSTOM CSS ---
-st.markdown("""
+# Static: built once per server process (see build_static_css) and emitted only on full-page
+# runs; fragment reruns keep the styles already in the browser.
+BASE_CSS = """
 <style>
 /* Main container background and text color (Black background, White text) */
 .main {
@@ -155,41 +217,39 @@ st.markdown("""
     font-family: 'Arial', sans-serif;
 }
 
-/* Custom styling for round action elements (Toggle and History) - Now using anchor tags */
-.round-action-btn {
-    /* Base style for the containing element */
-    display: flex;
-    align-items: center;
-    justify-content: center;
-    width: 50px; 
-    height: 50px;
-    border-radius: 50%; 
-    background-color: #1f2937; /* Dark Gray */ 
-    box-shadow: 0 4px 6px rgba(0, 0, 0, 0.5); 
-    transition: all 0.2s ease-in-out;
-    cursor: pointer;
-    text-decoration: none; /* Remove default anchor underline */
-}
+/* Custom styling for round action elements (Toggle, History, Back) - native buttons targeted by their st-key-* class */
+.st-key-toggle_brain button, .st-key-toggle_eye button, .st-key-history_btn button, .st-key-back_btn button {
+    /* Base style for the button element */
+    display: flex !important;
+    align-items: center !important;
+    justify-content: center !important;
+    width: 50px !important; 
+    height: 50px !important;
+    border-radius: 50% !important; 
+    background-color: #1f2937 !important; /* Dark Gray */ 
+    box-shadow: 0 4px 6px rgba(0, 0, 0, 0.5) !important; 
+    transition: all 0.2s ease-in-out !important;
+    cursor: pointer !important;
+    padding: 5px !important;
 
-/* Hover effect for the anchor tag element */
-.round-action-btn:hover {
-    transform: scale(1.1);
-    background-color: #2c3a4d;
-    box-shadow: 0 6px 10px rgba(0, 0, 0, 0.7);
+    /* Icon images are set as backgrounds (see build_static_css) */
+    background-size: cover !important;
+    background-origin: content-box !important;
+    background-repeat: no-repeat !important;
+    background-position: center !important;
 }
 
-/* Styling for images inside the round action elements */
-.round-button-img {
-    width: 100%; 
-    height: 100%;
-    border-radius: 50%; 
-    object-fit: cover;
-    padding: 5px; 
+/* Hover effect for the round buttons */
+.st-key-toggle_brain button:hover, .st-key-toggle_eye button:hover,
+.st-key-history_btn button:hover, .st-key-back_btn button:hover {
+    transform: scale(1.1) !important;
+    background-color: #2c3a4d !important;
+    box-shadow: 0 6px 10px rgba(0, 0, 0, 0.7) !important;
 }
 
-/* Style for the emoji used in the back button to center it */
-.round-action-btn span {
-    padding: 10px; /* Adjust padding to make the emoji sit right in the center */
+/* Style for the emoji used in the back button */
+.st-key-back_btn button p {
+    font-size: 1.5em !important;
 }
 
 /* NEW STYLES for the Streamlit Predict/Send button (Targeting the native component) */
@@ -243,63 +303,103 @@ footer {visibility: hidden;}
     padding-right: 2rem;
 }
 </style>
-""", unsafe_allow_html=True)
+"""
+
+
+@st.cache_resource
+def build_static_css():
+    """Full <style> markup: base theme plus icon-button rules that embed the Base64 icons."""
+    brain_src = get_base64_image("images/brain.png")
+    eye_src = get_base64_image("images/eye.png")
+    history_src = get_base64_image("images/history.png")
+    send_src = get_base64_image("images/send.png")
+    return BASE_CSS + f"""
+<style>
+/* Icons for the round top-bar buttons */
+.st-key-toggle_brain button {{ background-image: url('{brain_src}') !important; }}
+.st-key-toggle_eye button {{ background-image: url('{eye_src}') !important; }}
+.st-key-history_btn button {{ background-image: url('{history_src}') !important; }}
+
+/* Target the Predict/Send button by its key class */
+.st-key-predict_button_native button {{
+    /* Embed the image using Base64 in CSS */
+    background-image: url('{send_src}') !important;
+    background-size: 60% !important; /* Adjust size of image inside button */
+    background-repeat: no-repeat !important;
+    background-position: center !important;
+
+    /* Remove text content of the button */
+    color: transparent !important;
+    font-size: 0 !important;
+    line-height: 0 !important;
+
+    /* Ensure it still has the blue background */
+    background-color: #3b82f6 !important;
+
+    /* Invert colors if needed (for white icon on blue background) */
+    filter: invert(1); 
+}}
+
+/* Apply hover/active styles to ensure visual feedback */
+.st-key-predict_button_native button:hover {{
+    filter: invert(1) brightness(1.2); /* Slight brightening on hover */
+}}
+</style>
+"""
+
+
+@st.cache_resource
+def title_markup():
+    """Static title + logo markup for the top bar."""
+    return """
+        <div class='title-bar'>
+            <h2 style='margin:0; color: #3b82f6;'>Cancer Detector</h2>
+            <span style='font-size: 1.5em;'>⚕️</span>
+        </div>
+        """
 
 
 # --- MODULAR COMPONENTS ---
 
+def mode_controls():
+    """Renders the brain/eye toggle button and the base/advanced radio.
+    Runs as its own fragment: switching modes reruns only these two widgets."""
+    # Key selects the icon via CSS (st-key-toggle_brain / st-key-toggle_eye)
+    mode = "brain" if st.session_state.toggle else "eye"
+    st.button(" ", key=f"toggle_{mode}", help="Toggle Mode", on_click=on_toggle_click)
+    # Add type toggle (base/advanced) as a horizontal radio below the icon
+    st.markdown("<div style='height: 8px;'></div>", unsafe_allow_html=True)
+    st.session_state.type_toggle = st.radio(
+        "Type:",
+        options=["base", "advanced"],
+        index=0 if st.session_state.type_toggle == "base" else 1,
+        horizontal=True,
+        key="type_radio",
+        label_visibility="collapsed"
+    )
+
+
 def top_bar():
     """Renders the top bar: action button (toggle or back), title+logo, and history button.
-    All anchor tags now include target="_self" to prevent opening new tabs."""
+    Buttons are native widgets with callbacks, so clicks never trigger a full page navigation."""
     # Columns [Action Button (1), Title (4), History Button (1)]
     col1, col2, col3 = st.columns([1, 4, 1])
 
     with col1:
         # Show Back button if on analysis_result OR history pages
         if st.session_state.page in ["analysis_result", "history"]:
-            st.markdown(f"""
-                <a href="?action=back" target="_self" class="round-action-btn" title="Go Back">
-                    <span style='font-size: 1.5em;'>⬅️</span> 
-                </a>
-            """, unsafe_allow_html=True)
+            st.button("⬅️", key="back_btn", help="Go Back", on_click=on_back_click)
         else:
-            # Display Toggle button on home page
-            image_name = "brain.png" if st.session_state.toggle else "eye.png"
-            toggle_src = get_base64_image(f"images/{image_name}")
-            st.markdown(f"""
-                <a href="?action=toggle" target="_self" class="round-action-btn" title="Toggle Mode">
-                    <img src='{toggle_src}' class='round-button-img' alt='Toggle Mode'>
-                </a>
-            """, unsafe_allow_html=True)
-            # Add type toggle (base/advanced) as a horizontal radio below the icon
-            st.markdown("<div style='height: 8px;'></div>", unsafe_allow_html=True)
-            st.session_state.type_toggle = st.radio(
-                "Type:",
-                options=["base", "advanced"],
-                index=0 if st.session_state.type_toggle == "base" else 1,
-                horizontal=True,
-                key="type_radio",
-                label_visibility="collapsed"
-            )
+            # Display Toggle button + type radio on home page (own fragment)
+            st.fragment(mode_controls)()
 
     with col3:
         # History button is always shown
-        history_src = get_base64_image("images/history.png")
-        action_param = "history"
-        st.markdown(f"""
-            <a href="?action={action_param}" target="_self" class="round-action-btn" title="View History">
-                <img src='{history_src}' class='round-button-img' alt='History Log'>
-            </a>
-        """, unsafe_allow_html=True)
+        st.button(" ", key="history_btn", help="View History", on_click=on_history_click)
 
     with col2:
         # Logo remains as emoji and is always shown
-        st.markdown(f"""
-        <div class='title-bar'>
-            <h2 style='margin:0; color: #3b82f6;'>Cancer Detector</h2>
-            <span style='font-size: 1.5em;'>⚕️</span>
-        </div>
-        """, unsafe_allow_html=True)
+        st.markdown(title_markup(), unsafe_allow_html=True)
 
 
 def upload_and_predict_row():
@@ -365,40 +465,7 @@ def upload_and_predict_row():
             # Spacer to align the button vertically with the uploader
             st.markdown("<div style='height: 40px;'></div>", unsafe_allow_html=True)
 
-            # Use Base64 helper to get the image source for CSS
-            send_src = get_base64_image("images/send.png")
-
-            # Inject CSS to set the image as the background for the target button
-            # We use the key to target this specific button instance
-            st.markdown(f"""
-            <style>
-            /* Target the specific Streamlit button element by its data-testid */
-            [data-testid*="stButton-predict_button_native"] button {{
-                /* Embed the image using Base64 in CSS */
-                background-image: url('{send_src}') !important;
-                background-size: 60% !important; /* Adjust size of image inside button */
-                background-repeat: no-repeat !important;
-                background-position: center !important;
-
-                /* Remove text content of the button */
-                color: transparent !important;
-                font-size: 0 !important;
-                line-height: 0 !important;
-
-                /* Ensure it still has the blue background */
-                background-color: #3b82f6 !important;
-
-                /* Invert colors if needed (for white icon on blue background) */
-                filter: invert(1); 
-            }}
-
-            /* Apply hover/active styles to ensure visual feedback */
-            [data-testid*="stButton-predict_button_native"] button:hover {{
-                filter: invert(1) brightness(1.2); /* Slight brightening on hover */
-            }}
-            </style>
-            """, unsafe_allow_html=True)
-
+            # The send icon comes from the cached static CSS (st-key-predict_button_native)
             # The st.button handles the click without navigating
             # We use a single space as the label, which is made transparent by the CSS above
             st.button(
@@ -409,26 +476,106 @@ def upload_and_predict_row():
             )
 
 
+def job_status_panel():
+    """
+    Polls the backend once for the current job. Runs as a fragment on a timer,
+    so waiting for a result never blocks or reruns the rest of the page.
+    """
+    import requests
+    from requests.exceptions import RequestException
+
+    job_id = st.session_state.job_id
+    if job_id is None:
+        return  # Finished on an earlier tick; the full rerun is already rendering it
+    try:
+        response = requests.get(f"{BACKEND_BASE_URL}/jobs/{job_id}", timeout=5)
+        response.raise_for_status()
+        job = response.json()
+    except RequestException as e:
+        st.warning(f"Waiting for backend... ({e})")
+        return
+
+    if job["status"] in ("done", "failed"):
+        st.session_state.analysis_result = job.get("result")
+        st.session_state.job_error = job.get("error")
+        st.session_state.job_id = None
+        st.rerun()  # Full rerun to render the outcome (and stop polling)
+    else:
+        st.info(f"⏳ Analysis {job['status']}... this page updates automatically.")
+
+
+def similar_cases_panel(result):
+    """
+    Shows the past cases nearest to this image (by model embedding). Fetched once per
+    image/target and kept in session state, so reruns do not hit the backend again.
+    """
+    import requests
+    from requests.exceptions import RequestException
+
+    key = (result.get("image_sha256"), result.get("target"))
+    if None in key:
+        return  # Result from an older backend without similarity info
+    cases = st.session_state.similar_cases.get(key)
+    if cases is None:
+        try:
+            response = requests.get(f"{BACKEND_BASE_URL}/similar", timeout=5,
+                                    params={"image_sha256": key[0], "target": key[1], "k": SIMILAR_CASES})
+            response.raise_for_status()
+            cases = response.json()["similar"]
+        except RequestException:
+            return  # Similar cases are optional; the prediction itself is already shown
+        st.session_state.similar_cases[key] = cases
+
+    st.markdown("---")
+    st.subheader("Similar past cases")
+    if not cases:
+        st.caption("No other analyzed cases yet.")
+        return
+    for col, case in zip(st.columns(len(cases)), cases):
+        with col:
+            st.image(case["image_url"], use_container_width=True,
+                     caption=f"{case['prediction']} ({case['score']:.0%} similar)")
+
+
 # --- PAGE RENDERING LOGIC ---
 
-# 1. Always call the top bar, which handles hiding its buttons based on state
-top_bar()
+def main_view():
+    """Top bar plus the current page. Runs as a fragment, so navigation (history/back)
+    and uploads rerun only this view; the page chrome and CSS are not re-sent."""
+    # 1. Always call the top bar, which handles hiding its buttons based on state
+    top_bar()
+
+    # 2. Render the rest of the content based on the session state page
+    if st.session_state.page == "home":
+        render_home()
+    elif st.session_state.page == "analysis_result":
+        render_analysis_result()
+    elif st.session_state.page == "history":
+        render_history()
 
-# 2. Render the rest of the content based on the session state page
-if st.session_state.page == "home":
+
+def render_home():
     # HOME PAGE - Shows the upload/predict row
     upload_and_predict_row()
 
+    # Show the error from the last predict click, if any
+    if st.session_state.predict_error:
+        st.error(st.session_state.predict_error)
+        st.session_state.predict_error = None  # Clear after showing
+
     # Show warning if needed after a failed predict attempt
     if st.session_state.show_predict_warning and st.session_state.uploaded_file_data is None:
         st.warning("🚨 Please upload an image file to begin the prediction.")
         st.session_state.show_predict_warning = False  # Clear flag after showing
 
 
-elif st.session_state.page == "analysis_result":
+def render_analysis_result():
     # ANALYSIS RESULT PAGE - Show result from backend
     result = st.session_state.get("analysis_result", None)
-    if result and "image_url" in result:
+    if st.session_state.job_id is not None:
+        # Job still pending: poll inside a fragment so only this block reruns on each tick
+        st.fragment(job_status_panel, run_every=JOB_POLL_SECONDS)()
+    elif result and "image_url" in result:
         st.markdown("<div style='height: 5vh;'></div>", unsafe_allow_html=True)
         st.title("Prediction Result")
         st.markdown("---")
@@ -440,12 +587,15 @@ elif st.session_state.page == "analysis_result":
             st.success(f"Prediction: {result['prediction']}")
         if "details" in result:
             st.info(result["details"])
+        similar_cases_panel(result)
+    elif st.session_state.get("job_error"):
+        st.error(f"Prediction failed: {st.session_state.job_error}")
     else:
         st.error("No prediction result available. Please upload an image and try again.")
         st.session_state.page = "home"
 
 
-elif st.session_state.page == "history":
+def render_history():
     # HISTORY PAGE
     st.title("Prediction History")
 
@@ -458,3 +608,10 @@ elif st.session_state.page == "history":
                 unsafe_allow_html=True)
     else:
         st.info("No previous predictions recorded yet. Use the Home page to start analyzing!")
+
+
+# Static styles: built once (cached), sent only on full-page runs
+st.markdown(build_static_css(), unsafe_allow_html=True)
+
+# Everything interactive lives in fragments below this point
+st.fragment(main_view)()
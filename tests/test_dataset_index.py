@@ -0,0 +1,44 @@
+# tests/test_dataset_index.py
+import numpy as np
+import pytest
+
+from app.training.dataset_index import group_duplicates, near_duplicate_pairs
+
+
+def brute_force_pairs(hashes, max_distance):
+    return {(i, j) for i in range(len(hashes)) for j in range(i + 1, len(hashes))
+            if bin(int(hashes[i]) ^ int(hashes[j])).count("1") <= max_distance}
+
+
+def hashes_with_near_duplicates(n, seed=0):
+    """Random 64-bit hashes plus copies of some of them with a few bits flipped."""
+    rng = np.random.default_rng(seed)
+    base = rng.integers(0, 2**63, size=n, dtype=np.uint64) << np.uint64(1)
+    copies = []
+    for h in base[:n // 2]:
+        flips = rng.choice(64, size=rng.integers(0, 10), replace=False)
+        copies.append(int(h) ^ sum(1 << int(b) for b in flips))
+    return np.concatenate([base, np.array(copies, dtype=np.uint64)])
+
+
+@pytest.mark.parametrize("max_distance", [0, 3, 6, 8])
+def test_near_duplicate_pairs_matches_brute_force(max_distance):
+    hashes = hashes_with_near_duplicates(300)
+    pairs = near_duplicate_pairs(hashes, max_distance, chunk=64)
+    found = {(int(i), int(j)) for i, j in pairs}
+    assert len(found) == len(pairs)
+    assert found == brute_force_pairs(hashes, max_distance)
+
+
+def test_near_duplicate_pairs_empty():
+    assert near_duplicate_pairs(np.array([1 << 40], dtype=np.uint64), 6).shape == (0, 2)
+
+
+def test_group_duplicates_joins_chains_and_exact_repeats():
+    a = 0x0123456789ABCDEF
+    b = a ^ 0b111  # 3 bits from a
+    c = b ^ 0b111000  # 3 bits from b, 6 from a
+    far = ~a & (2**64 - 1)
+    groups = group_duplicates([a, far, c, a, b], max_distance=3)
+    assert groups[0] == groups[2] == groups[3] == groups[4]
+    assert groups[1] != groups[0]
@@ -0,0 +1,34 @@
+# tests/test_jobs.py
+from app.jobs import JobQueue
+from app.storage import ContentStore
+
+
+def test_claim_and_requeue_until_attempts_cap(tmp_path):
+    store = ContentStore(str(tmp_path / "uploads"))
+    digest = store.put(b"not an image")
+    queue = JobQueue(store, str(tmp_path / "jobs"), max_attempts=2)
+    job_id = queue.enqueue(digest, "scan.png", "brain", "base")
+
+    assert queue.claim()["id"] == job_id
+    assert queue.claim() is None  # running jobs are not handed out twice
+
+    # a restart re-queues the interrupted job...
+    queue = JobQueue(store, str(tmp_path / "jobs"), max_attempts=2)
+    assert queue.get(job_id)["status"] == "queued"
+    assert queue.claim()["id"] == job_id
+
+    # ...until it has been attempted max_attempts times
+    queue = JobQueue(store, str(tmp_path / "jobs"), max_attempts=2)
+    job = queue.get(job_id)
+    assert job["status"] == "failed" and job["error"]
+    assert queue.claim() is None
+
+
+def test_finish_records_result(tmp_path):
+    store = ContentStore(str(tmp_path / "uploads"))
+    queue = JobQueue(store, str(tmp_path / "jobs"))
+    job_id = queue.enqueue(store.put(b"x"), None, "eye", "advanced")
+    queue.claim()
+    queue.finish(job_id, result={"prediction": "Normal"})
+    job = queue.get(job_id)
+    assert job["status"] == "done" and job["result"] == {"prediction": "Normal"}
@@ -0,0 +1,81 @@
+# tests/test_similarity.py
+import hashlib
+import threading
+
+import numpy as np
+
+from app.similarity import EmbeddingIndex, SimilarityIndex
+
+DIM = 16
+
+
+def digest(i):
+    return hashlib.sha256(str(i).encode()).hexdigest()
+
+
+def embeddings(n, seed=0):
+    return np.random.default_rng(seed).standard_normal((n, DIM)).astype(np.float32)
+
+
+def assert_round_trip(index, vectors):
+    for i, vec in enumerate(vectors):
+        row = index.find(digest(i))
+        assert row == i
+        assert index.digest(row) == digest(i)
+        assert index.label(row) == i % 3
+        # probing every list makes the search exact: each stored vector is its own nearest neighbour
+        assert index.search(vec, k=1, nprobe=len(vectors))[0][0] == i
+
+
+def test_add_rebuild_find_round_trip(tmp_path):
+    vectors = embeddings(300)
+    index = EmbeddingIndex(str(tmp_path), DIM)
+    for i, vec in enumerate(vectors[:200]):
+        assert index.add(digest(i), vec, i % 3)
+    assert not index.add(digest(0), vectors[0], 0)  # already stored
+    assert index.find(digest(10**6)) is None
+    assert_round_trip(index, vectors[:200])
+
+    index.rebuild()
+    assert index.indexed == 200
+    for i, vec in enumerate(vectors[200:], start=200):
+        index.add(digest(i), vec, i % 3)
+    assert_round_trip(index, vectors)
+
+    # reopening reads the committed layout plus the rows appended after it
+    reopened = EmbeddingIndex(str(tmp_path), DIM)
+    assert reopened.count == 300 and reopened.indexed == 200
+    assert_round_trip(reopened, vectors)
+
+
+def test_rebuild_with_concurrent_add(tmp_path):
+    vectors = embeddings(1000, seed=1)
+    index = EmbeddingIndex(str(tmp_path), DIM)
+    for i, vec in enumerate(vectors[:500]):
+        index.add(digest(i), vec, i % 3)
+
+    def add_rest():
+        for i, vec in enumerate(vectors[500:], start=500):
+            index.add(digest(i), vec, i % 3)
+
+    adder = threading.Thread(target=add_rest)
+    adder.start()
+    index.rebuild()
+    adder.join()
+
+    assert index.count == 1000
+    assert 500 <= index.indexed <= 1000
+    assert [index.find(digest(i)) for i in range(1000)] == list(range(1000))
+    index.rebuild()
+    assert index.indexed == 1000
+    assert_round_trip(index, vectors)
+
+
+def test_similarity_index_is_keyed_by_version(tmp_path):
+    similarity = SimilarityIndex(str(tmp_path))
+    vectors = embeddings(20)
+    for i, vec in enumerate(vectors):
+        similarity.add("brain", "aaaaaaaaaaaa", digest(i), vec, i % 3)
+    hits = similarity.similar("brain", "aaaaaaaaaaaa", digest(0), DIM, k=3)
+    assert len(hits) == 3 and digest(0) not in [h for h, _, _ in hits]
+    assert similarity.similar("brain", "bbbbbbbbbbbb", digest(0), DIM) is None